@@ -1,11 +1,16 @@
 import os
 import sys
+import time
+import asyncio
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 project_root = os.path.abspath(os.path.dirname(__file__))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 from config import Config
 from models import db, User
 from forms import LoginForm, RegistrationForm
@@ -14,13 +19,17 @@ from flask_socketio import SocketIO, emit
 
 from dotenv import load_dotenv
 from services_backend.ai_adapter import AI_Adapter
-from services_backend.memory_service import MemoryService
-from services_backend.orchestrator_service import OrchestratorService
+from services_backend.orchestrator_registry import OrchestratorRegistry
 from services_backend.summarizer_service import SummarizerService
 from services_backend.tagger_service import TaggerService
 from services_backend.segmenter_service import SegmenterService
 from services_backend.utils.model_resolver import build_available_model_rankings
-from sentence_transformers import SentenceTransformer
+from services_backend.utils.embedding_cache import CachedEmbeddingModel
+from services_backend.embedding_service import EmbeddingService
+from services_backend.intent_classifier import IntentClassifier
+from services_backend.model_router import ModelRouter
+from services_backend.async_runtime import AsyncRuntime
+from services_backend.utils.metrics import REGISTRY as METRICS_REGISTRY
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -49,66 +58,219 @@ ai_adapter = AI_Adapter()
 summarizer_service = SummarizerService(ai_adapter)
 tagger_service = TaggerService(ai_adapter)
 segmenter_service = SegmenterService(ai_adapter)
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
-user_orchestrators = {}
-print("[BuddyApp]: Serviços globais de IA prontos.")
+def load_embedding_model():
+    # Importado só aqui: sentence_transformers traz o torch, que demora segundos a carregar.
+    if Config.EMBEDDING_PROCESS_WORKERS > 0 and __name__ == "__main__":
+        # Com `python app.py` cada processo "spawn" voltaria a executar este ficheiro inteiro.
+        print("[BuddyApp]: EMBEDDING_PROCESS_WORKERS ignorado ao executar app.py diretamente; use `python -m flask run`.")
+    elif Config.EMBEDDING_PROCESS_WORKERS > 0:
+        from services_backend.embedding_pool import ProcessEmbeddingModel
+        return ProcessEmbeddingModel(Config.EMBEDDING_MODEL_NAME, Config.EMBEDDING_PROCESS_WORKERS)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(Config.EMBEDDING_MODEL_NAME)
+
+embedding_service = EmbeddingService(load_embedding_model)
+embedding_model = CachedEmbeddingModel(
+    embedding_service,
+    model_name=Config.EMBEDDING_MODEL_NAME,
+    disk_path=Config.EMBEDDING_CACHE_DISK_PATH
+)
+intent_classifier = IntentClassifier(embedding_model)
+model_router = ModelRouter()
+
+def create_user_orchestrator(user_id):
+    from services_backend.memory_service import MemoryService
+    from services_backend.orchestrator_service import OrchestratorService
+    print(f"[BuddyApp]: Criando nova instância de serviços para o usuário {user_id}...")
+    memory = MemoryService(
+        user_id=user_id,
+        embedding_model=embedding_model,
+        summarizer=summarizer_service,
+        tagger=tagger_service,
+        segmenter=segmenter_service
+    )
+    return OrchestratorService(
+        memory_service=memory,
+        ai_adapter=ai_adapter,
+        embedding_model=embedding_model,
+        intent_classifier=intent_classifier,
+        model_router=model_router
+    )
+
+orchestrator_registry = OrchestratorRegistry(create_user_orchestrator)
+atexit.register(orchestrator_registry.shutdown_all)
+atexit.register(embedding_model.close)
+atexit.register(embedding_service.close)
+atexit.register(intent_classifier.close)
+async_runtime = AsyncRuntime()
+atexit.register(async_runtime.close)
+print("[BuddyApp]: Serviços globais de IA prontos (modelos carregados em segundo plano).")
+
+_warmup_lock = threading.Lock()
+_warmup_started = False
+
+def _warm_up_services():
+    ai_adapter.warm_up()
+    try:
+        intent_classifier.warm_up()
+    except Exception as e:
+        print(f"[BuddyApp]: Falha ao carregar os exemplos do classificador local: {e}")
+    try:
+        import services_backend.orchestrator_service  # noqa: F401 (carrega faiss e numpy)
+    except Exception as e:
+        print(f"[BuddyApp]: Falha ao pré-carregar os serviços por usuário: {e}")
+
+def start_warmup():
+    """Carrega o modelo de embeddings e os SDKs em segundo plano (só uma vez, nunca na CLI)."""
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    embedding_service.start()
+    threading.Thread(target=_warm_up_services, daemon=True).start()
+
+@app.before_request
+def trigger_warmup():
+    start_warmup()
+
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS_REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    state = {
+        "embedding_model": embedding_service.state(),
+        "ai_providers": ai_adapter.sdk_state(),
+    }
+    ready = all(value == "ready" for value in state.values())
+    return jsonify({"ready": ready, **state}), 200 if ready else 503
+
+_first_token_lock = threading.Lock()
+_first_token_stats = {"warm": {"count": 0, "total_ms": 0.0}, "cold": {"count": 0, "total_ms": 0.0}}
+
+def record_first_token_latency(seconds: float, warm: bool):
+    """Tempo entre a chegada da mensagem e o primeiro pedaço da resposta, separado por instância quente/fria."""
+    kind = "warm" if warm else "cold"
+    elapsed_ms = seconds * 1000
+    with _first_token_lock:
+        _first_token_stats[kind]["count"] += 1
+        _first_token_stats[kind]["total_ms"] += elapsed_ms
+    print(f"[BuddyApp]: Primeiro token em {elapsed_ms:.0f} ms (instância {'pré-carregada' if warm else 'criada no pedido'}).")
+
+def first_token_stats() -> dict:
+    with _first_token_lock:
+        return {
+            kind: {**values, "avg_ms": values["total_ms"] / values["count"] if values["count"] else None}
+            for kind, values in _first_token_stats.items()
+        }
 
 def get_user_orchestrator():
-    user_id = current_user.id
-    if user_id not in user_orchestrators:
-        print(f"[BuddyApp]: Criando nova instância de serviços para o usuário {user_id}...")
-        memory = MemoryService(
-            user_id=user_id,
-            embedding_model=embedding_model,
-            summarizer=summarizer_service,
-            tagger=tagger_service,
-            segmenter=segmenter_service
-        )
-        orchestrator = OrchestratorService(
-            memory_service=memory,
-            ai_adapter=ai_adapter,
-            embedding_model=embedding_model
-        )
-        user_orchestrators[user_id] = orchestrator
-    return user_orchestrators[user_id]
+    return orchestrator_registry.get(current_user.id)
 
 @app.route("/")
 @login_required 
 def home():
-    get_user_orchestrator()
+    orchestrator_registry.prefetch(current_user.id)
     return render_template("index.html", username=current_user.username)
 
 
 @socketio.on('connect')
 def handle_connect():
-    """Acionado quando um cliente se conecta. Envia o histórico do chat."""
+    """Acionado quando um cliente se conecta. Envia a página mais recente do histórico."""
     if current_user.is_authenticated:
         orchestrator = get_user_orchestrator()
-        history = orchestrator.get_full_history()
-        emit('load_history', {'history': history})
+        history, cursor = orchestrator.get_history_page()
+        emit('load_history', {'history': history, 'cursor': cursor})
         print(f"Histórico enviado para o usuário {current_user.id}")
 
+@socketio.on('load_more_history')
+def handle_load_more_history(data):
+    """Envia a página de mensagens anterior ao cursor recebido do cliente."""
+    if not current_user.is_authenticated:
+        return
+    cursor = data.get('cursor') if isinstance(data, dict) else None
+    if not isinstance(cursor, int) or isinstance(cursor, bool) or cursor <= 0:
+        return
+    orchestrator = get_user_orchestrator()
+    history, next_cursor = orchestrator.get_history_page(cursor)
+    emit('history_page', {'history': history, 'cursor': next_cursor})
+
 @socketio.on('new_message')
 def handle_new_message(data):
     user_message_text = data.get('message', '')
     if not user_message_text:
         return
-    orchestrator = get_user_orchestrator()
-    user_message = {"role": "user", "parts": [user_message_text]}
-    orchestrator.add_to_history(user_message)
-    emit('stream_start')
-    response_generator = orchestrator.generate_response_stream()
-    full_response = ""
-    for chunk in response_generator:
-        if chunk == "[STREAM_END]":
-            break
-        full_response += chunk
-        emit('stream_chunk', {'data': chunk})
-    emit('stream_end')
-    if full_response:
-        model_response = {"role": "model", "parts": [full_response]}
-        orchestrator.add_to_history(model_response)
+    started_at = time.perf_counter()
+    was_resident = orchestrator_registry.is_resident(current_user.id)
+    if Config.ASYNC_PIPELINE_ENABLED:
+        # O turno segue no loop asyncio; esta thread do Socket.IO fica livre de imediato.
+        emit('stream_start')
+        async_runtime.submit(stream_turn_async(current_user.id, request.sid, user_message_text, started_at, was_resident))
+        return
+    with orchestrator_registry.lease(current_user.id) as orchestrator:
+        user_message = {"role": "user", "parts": [user_message_text]}
+        orchestrator.add_to_history(user_message)
+        emit('stream_start')
+        response_generator = orchestrator.generate_response_stream()
+        full_response = ""
+        for chunk in response_generator:
+            if chunk == "[STREAM_END]":
+                # O gerador corre até ao fim para registar a resposta no bloco do tópico.
+                continue
+            if not full_response:
+                record_first_token_latency(time.perf_counter() - started_at, was_resident)
+            full_response += chunk
+            emit('stream_chunk', {'data': chunk})
+        emit('stream_end')
+        if full_response:
+            model_response = {"role": "model", "parts": [full_response]}
+            orchestrator.add_to_history(model_response)
+
+_hydration_executor = ThreadPoolExecutor(max_workers=Config.ASYNC_HYDRATION_WORKERS, thread_name_prefix="orchestrator-hydrate")
+
+async def stream_turn_async(user_id, sid, user_message_text: str, started_at: float, was_resident: bool):
+    """Turno de conversa no AsyncRuntime; os pedaços são enviados ao cliente `sid` à medida que chegam."""
+    loop = asyncio.get_running_loop()
+    lease = orchestrator_registry.lease(user_id)
+    stream_ended = False
+    entered = False
+    try:
+        # Montar a instância do usuário (se não estiver no pool) é bloqueante e pode demorar:
+        # corre num executor próprio para não esgotar as threads das etapas dos outros turnos.
+        orchestrator = await loop.run_in_executor(_hydration_executor, lease.__enter__)
+        entered = True
+        user_message = {"role": "user", "parts": [user_message_text]}
+        await asyncio.to_thread(orchestrator.add_to_history, user_message)
+        full_response = ""
+        async for chunk in orchestrator.generate_response_stream_async():
+            if chunk == "[STREAM_END]":
+                continue
+            if not full_response:
+                record_first_token_latency(time.perf_counter() - started_at, was_resident)
+            full_response += chunk
+            socketio.emit('stream_chunk', {'data': chunk}, to=sid)
+        socketio.emit('stream_end', to=sid)
+        stream_ended = True
+        if full_response:
+            model_response = {"role": "model", "parts": [full_response]}
+            await asyncio.to_thread(orchestrator.add_to_history, model_response)
+    except Exception as e:
+        print(f"[BuddyApp]: Erro no turno assíncrono do usuário {user_id}: {e}")
+        if not stream_ended:
+            socketio.emit('stream_chunk', {'data': f"Ocorreu um erro ao preparar a resposta: {e}"}, to=sid)
+    finally:
+        # O cliente já recebeu stream_start: fecha sempre o stream do lado dele.
+        if not stream_ended:
+            socketio.emit('stream_end', to=sid)
+        if entered:
+            await loop.run_in_executor(_hydration_executor, lease.__exit__, None, None, None)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -119,6 +281,8 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.check_password(form.password.data):
             login_user(user)
+            # Os serviços do usuário são montados enquanto o navegador carrega a página.
+            orchestrator_registry.prefetch(user.id)
             return redirect(url_for('home'))
         else:
             flash('Login sem sucesso. Verifique o nome de usuário e a senha.', 'danger')
@@ -141,13 +305,36 @@ def register():
 @app.route('/logout')
 @login_required
 def logout():
-    if current_user.id in user_orchestrators:
-        del user_orchestrators[current_user.id]
-        print(f"[BuddyApp]: Instância de serviços removida para o usuário {current_user.id}.")
+    orchestrator_registry.remove(current_user.id)
     logout_user()
     flash('Você foi desconectado com sucesso.')
     return redirect(url_for('login'))
 
+@app.route('/stats/orchestrators')
+@login_required
+def orchestrator_stats():
+    return jsonify({**orchestrator_registry.stats(), "first_token_latency": first_token_stats()})
+
+@app.route('/stats/intent-classifier')
+@login_required
+def intent_classifier_stats():
+    return jsonify(intent_classifier.stats())
+
+@app.route('/stats/models')
+@login_required
+def model_router_stats():
+    return jsonify(model_router.stats())
+
+@app.route('/stats/async-runtime')
+@login_required
+def async_runtime_stats():
+    return jsonify(async_runtime.stats())
+
+@app.route('/stats/embeddings')
+@login_required
+def embedding_stats():
+    return jsonify({"cache": embedding_model.stats(), "batching": embedding_service.stats()})
+
 @app.cli.command("init-db")
 def init_db_command():
     with app.app_context():
@@ -155,4 +342,7 @@ def init_db_command():
     print("Banco de dados inicializado.")
 
 if __name__ == "__main__":
+    # Com o reloader do modo debug, só o processo filho atende pedidos e aquece os modelos.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warmup()
     socketio.run(app, debug=True)
\ No newline at end of file
@@ -28,4 +28,117 @@ class Config:
 
     CONTEXTUALIZER_SIMILARITY_THRESHOLD = 0.7
 
+    EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+    # Cache de embeddings partilhada entre usuários (LRU em memória + SQLite opcional).
+    # Defina EMBEDDING_CACHE_DISK_PATH como None para manter só a cache em memória.
+    EMBEDDING_CACHE_MAX_ENTRIES = 50000
+    EMBEDDING_CACHE_DISK_PATH = os.path.join(BUDDY_DATA_BASE_PATH, 'embedding_cache.db')
+    # Limite de linhas do SQLite (~1,5 KB cada com o all-MiniLM-L6-v2); acima dele saem as
+    # menos usadas recentemente.
+    EMBEDDING_CACHE_DISK_MAX_ENTRIES = 100000
+    # Micro-lotes do serviço de embeddings: pedidos simultâneos são juntos num único encode.
+    EMBEDDING_BATCH_MAX_SIZE = 64
+    EMBEDDING_BATCH_MAX_WAIT_MS = 2
+    # Processos dedicados ao modelo de embeddings (fora do GIL das threads do Socket.IO).
+    # 0 mantém o modelo no próprio processo do servidor.
+    EMBEDDING_PROCESS_WORKERS = int(os.environ.get('EMBEDDING_PROCESS_WORKERS', 0))
+
+    # Cache em memória do MemoryService: o histórico e os factos são lidos do disco
+    # uma vez e as escritas são agrupadas por uma thread em background.
+    HISTORY_CACHE_MAX_MESSAGES = 500
+    HISTORY_FLUSH_BATCH_SIZE = 20
+    MEMORY_FLUSH_INTERVAL_SECONDS = 2.0
+
+    # Conexões SQLite persistentes por memory.db (modo WAL).
+    SQLITE_MAX_CONNECTIONS = 4
+    SQLITE_BUSY_TIMEOUT_SECONDS = 5.0
+    SQLITE_CACHE_SIZE_KB = 8192
+    SQLITE_MMAP_SIZE_BYTES = 64 * 1024 * 1024
+
+    # Índice FAISS por usuário: plano (produto interno) até VECTOR_INDEX_IVF_THRESHOLD
+    # memórias, depois IVF com ~LISTS_PER_SQRT * sqrt(n) listas, retreinado em background
+    # sempre que o número de listas desejado dobra.
+    VECTOR_INDEX_IVF_THRESHOLD = 20000
+    VECTOR_INDEX_IVF_LISTS_PER_SQRT = 4
+    VECTOR_INDEX_IVF_NPROBE = 16
+    # Recuperação híbrida: cada busca (FAISS e FTS5/BM25) devolve
+    # n_results * HYBRID_CANDIDATE_MULTIPLIER candidatos, combinados por Reciprocal Rank Fusion.
+    HYBRID_CANDIDATE_MULTIPLIER = 4
+    HYBRID_RRF_K = 60
+    HYBRID_MAX_QUERY_TERMS = 16
+    # Com as tags do ActionPlan, a busca fica restrita às memórias que partilham essas tags;
+    # se o filtro devolver menos de n_results resultados, repete-se a busca no índice inteiro.
+    # Acima de TAG_PREFILTER_MAX_CANDIDATES memórias o filtro deixa de compensar.
+    TAG_PREFILTER_MAX_CANDIDATES = 20000
+
+    # Memórias abaixo desta similaridade de cosseno com a pergunta não são injetadas no prompt.
+    RAG_MIN_SIMILARITY = 0.3
+    # Maximal Marginal Relevance: 1.0 ordena só por relevância; valores menores favorecem diversidade.
+    RAG_MMR_LAMBDA = 0.7
+    # Candidatas com esta similaridade (ou mais) com uma memória já escolhida são descartadas como duplicadas.
+    RAG_DUPLICATE_SIMILARITY = 0.95
+    # Orçamento (tokens estimados) do bloco <RECALLED_MEMORIES>.
+    RAG_TOKEN_BUDGET = 600
+    # Threads que executam a recuperação (embedding + FAISS) em paralelo com o classificador.
+    SPECULATIVE_RETRIEVAL_WORKERS = 4
+    # Candidatas que a busca especulativa devolve; as tags do plano reordenam-nas depois.
+    SPECULATIVE_RETRIEVAL_CANDIDATES = 12
+
+    # Classificador de intenção local (kNN sobre os ActionPlans já devolvidos pelo LLM).
+    # Abaixo de INTENT_CLASSIFIER_CONFIDENCE_THRESHOLD o pedido vai para o LLM.
+    INTENT_CLASSIFIER_DB_PATH = os.path.join(BUDDY_DATA_BASE_PATH, 'intent_examples.db')
+    INTENT_CLASSIFIER_K = 7
+    INTENT_CLASSIFIER_MIN_EXAMPLES = 50
+    INTENT_CLASSIFIER_MIN_SIMILARITY = 0.5
+    INTENT_CLASSIFIER_CONFIDENCE_THRESHOLD = 0.8
+    INTENT_CLASSIFIER_MAX_EXAMPLES = 20000
+    # Fração das previsões locais em que o LLM também corre, em segundo plano, para medir a
+    # concordância; 0 desliga a sombra. Nos restantes turnos locais os factos são extraídos
+    # por um pedido próprio ao classificador, também em segundo plano.
+    INTENT_CLASSIFIER_SHADOW_RATE = 0.05
+
+    # Circuit breaker e ordenação dos modelos de geração (partilhados entre usuários).
+    # O circuito abre após MODEL_ROUTER_FAILURE_THRESHOLD falhas seguidas e é testado de novo
+    # após MODEL_ROUTER_OPEN_SECONDS (dobrando a cada teste falhado, até ao máximo).
+    MODEL_ROUTER_FAILURE_THRESHOLD = 3
+    MODEL_ROUTER_OPEN_SECONDS = 30
+    MODEL_ROUTER_MAX_OPEN_SECONDS = 300
+    MODEL_ROUTER_EWMA_ALPHA = 0.3
+    # Pontos de ranking (escala 1-10) descontados por segundo de latência média e por taxa de erro.
+    MODEL_ROUTER_LATENCY_WEIGHT = 1.0
+    MODEL_ROUTER_ERROR_WEIGHT = 5.0
+    # Prazo para o primeiro pedaço de texto de um modelo antes de o seguinte da cascata
+    # arrancar em paralelo (o primeiro a responder ganha). 0 desliga esta corrida.
+    GENERATION_FIRST_TOKEN_DEADLINE_SECONDS = 8.0
+    # Handles de modelos Gemini guardados pelo AI_Adapter, por (modelo, instrução de sistema, config).
+    AI_MODEL_HANDLE_CACHE_SIZE = 64
+    # Turnos de conversa no loop asyncio dedicado (AsyncRuntime) em vez de na thread do
+    # handler do Socket.IO. 0 volta ao pipeline síncrono.
+    ASYNC_PIPELINE_ENABLED = os.environ.get('ASYNC_PIPELINE_ENABLED', '1') == '1'
+    # Threads próprias para montar/libertar as instâncias por usuário a partir do loop asyncio,
+    # separadas do executor por omissão usado pelas etapas de cada turno.
+    ASYNC_HYDRATION_WORKERS = 4
+
+    # Alterações acumuladas no memory.faiss.log antes de um novo checkpoint do memory.faiss.
+    VECTOR_INDEX_CHECKPOINT_EVERY = 200
+
+    # Pool de instâncias de serviços por usuário (app.orchestrator_registry).
+    ORCHESTRATOR_POOL_MAX_SIZE = 100
+    ORCHESTRATOR_POOL_MAX_BYTES = 1024 * 1024 * 1024
+    ORCHESTRATOR_IDLE_TTL_SECONDS = 30 * 60
+    # Intervalo da verificação do limite de memória do pool (feita só na thread de limpeza).
+    ORCHESTRATOR_MEMORY_CHECK_SECONDS = 15
+
+    # Número de mensagens por página enviada ao cliente (load_history / load_more_history).
+    HISTORY_PAGE_SIZE = 50
+
+    # Janela de contexto: orçamento estimado (instrução de sistema + histórico).
+    # Mensagens recentes entram literalmente; trechos antigos de
+    # CONTEXT_COMPACTION_SPAN_MESSAGES mensagens são substituídos por resumos.
+    CONTEXT_TOKEN_BUDGET = 8000
+    CONTEXT_SUMMARY_BUDGET_RATIO = 0.25
+    CONTEXT_MIN_RECENT_MESSAGES = 4
+    CONTEXT_COMPACTION_SPAN_MESSAGES = 20
+    CONTEXT_MAX_SUMMARY_SPANS = 10
+
     DYNAMIC_MODEL_RANKINGS = {}
\ No newline at end of file
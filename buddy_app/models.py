@@ -30,4 +30,11 @@ class ActionPlan(BaseModel):
     needs_search: bool = False
     needs_long_term_memory: bool = False
     tags: List[str] = Field(default_factory=list)
-    extracted_facts: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    extracted_facts: Optional[Dict[str, Any]] = None
+
+class RetrievedMemory(BaseModel):
+    memory_id: int
+    summary: str
+    tags: List[str] = Field(default_factory=list)
+    similarity: float
+    score: float
\ No newline at end of file
@@ -1,25 +1,127 @@
 # Arquivo: buddy_app/backend/services/ai_adapter.py (Completo e Atualizado)
 
-import google.generativeai as genai
-import openai
 import os
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
+from config import Config
 
 class AI_Adapter:
     def __init__(self):
+        # Os SDKs (google.generativeai, openai) só são importados no primeiro uso
+        # ou em `warm_up()`, para não atrasar o arranque nem os comandos da CLI.
+        self._sdk_lock = threading.Lock()
+        self._genai = None
+        self._openai = None
+        self._gemini_api_key = None
+        self._genai_configured_key = None
+        self._openai_api_key = None
+        self._sdk_error = None
+        # Clientes de longa duração: o cliente OpenAI mantém o pool de ligações HTTP
+        # (keep-alive) entre chamadas e os GenerativeModel do Gemini são reutilizados.
+        # Ambos são recriados apenas quando `_configure_apis` muda as chaves.
+        self._openai_client = None
+        self._async_openai_client = None
+        self._gemini_models = OrderedDict()
         self._configure_apis()
         print("[AI Adapter]: Adaptador de IA inicializado e pronto.")
 
+    def _get_genai(self):
+        with self._sdk_lock:
+            if self._genai is None:
+                import google.generativeai as genai
+                self._genai = genai
+            if self._gemini_api_key and self._genai_configured_key != self._gemini_api_key:
+                self._configure_genai(self._gemini_api_key)
+            return self._genai
+
+    def _configure_genai(self, api_key: str):
+        # Chamado com o _sdk_lock adquirido. Os GenerativeModel ficam presos ao cliente
+        # da configuração anterior, por isso a cache é descartada.
+        self._genai.configure(api_key=api_key)
+        self._genai_configured_key = api_key
+        self._gemini_models.clear()
+
+    def _get_gemini_model(self, model_name: str, system_instruction: str, json_mode: bool):
+        genai = self._get_genai()
+        cache_key = (model_name, system_instruction, json_mode)
+        with self._sdk_lock:
+            model = self._gemini_models.get(cache_key)
+            if model is not None:
+                self._gemini_models.move_to_end(cache_key)
+                return model
+            generation_config = genai.GenerationConfig(response_mime_type="application/json") if json_mode else None
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                system_instruction=system_instruction,
+                generation_config=generation_config
+            )
+            self._gemini_models[cache_key] = model
+            if len(self._gemini_models) > Config.AI_MODEL_HANDLE_CACHE_SIZE:
+                self._gemini_models.popitem(last=False)
+            return model
+
+    def _get_openai(self):
+        with self._sdk_lock:
+            if self._openai is None:
+                import openai
+                self._openai = openai
+            return self._openai
+
+    def _get_openai_client(self):
+        openai = self._get_openai()
+        with self._sdk_lock:
+            if self._openai_client is None:
+                # O cliente é thread-safe e partilhado por todas as chamadas.
+                self._openai_client = openai.OpenAI(api_key=self._openai_api_key)
+            return self._openai_client
+
+    def _get_async_openai_client(self):
+        # Usado apenas no loop asyncio da aplicação (AsyncRuntime), ao qual fica ligado.
+        openai = self._get_openai()
+        with self._sdk_lock:
+            if self._async_openai_client is None:
+                self._async_openai_client = openai.AsyncOpenAI(api_key=self._openai_api_key)
+            return self._async_openai_client
+
+    def warm_up(self):
+        """Importa os SDKs dos provedores em segundo plano, antes do primeiro pedido."""
+        try:
+            self._get_genai()
+            self._get_openai()
+            print("[AI Adapter]: SDKs dos provedores carregados.")
+        except Exception as e:
+            self._sdk_error = e
+            print(f"[AI Adapter]: Falha ao carregar os SDKs dos provedores: {e}")
+
+    def sdk_state(self) -> str:
+        if self._sdk_error is not None:
+            return "failed"
+        return "ready" if self._genai is not None and self._openai is not None else "loading"
+
     def _configure_apis(self):
         try:
             dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
             load_dotenv(dotenv_path=dotenv_path)
             
             gemini_api_key = os.getenv("GEMINI_API_KEY")
-            if gemini_api_key:
-                genai.configure(api_key=gemini_api_key)
+            self._gemini_api_key = gemini_api_key
+            if gemini_api_key and self._genai is not None:
+                self._get_genai()
+
+            openai_api_key = os.getenv("OPENAI_API_KEY")
+            with self._sdk_lock:
+                if openai_api_key != self._openai_api_key:
+                    stale_client, self._openai_client = self._openai_client, None
+                    # O cliente assíncrono só pode ser fechado no seu loop; é descartado.
+                    self._async_openai_client = None
+                    self._openai_api_key = openai_api_key
+                else:
+                    stale_client = None
+            if stale_client is not None:
+                stale_client.close()
             
-            if not os.getenv("OPENAI_API_KEY") and not gemini_api_key:
+            if not openai_api_key and not gemini_api_key:
                  print("[AI Adapter]: Nenhuma chave de API (GEMINI_API_KEY ou OPENAI_API_KEY) foi encontrada.")
 
         except Exception as e:
@@ -34,7 +136,9 @@ class AI_Adapter:
         """
         try:
             print("[AI Adapter]: Tentando validar a chave como Google Gemini...")
-            genai.configure(api_key=api_key)
+            genai = self._get_genai()
+            with self._sdk_lock:
+                self._configure_genai(api_key)
             genai.get_model('models/gemini-1.5-flash-latest')
             print("[AI Adapter]: Chave validada com sucesso como GEMINI_API_KEY.")
             return "GEMINI_API_KEY"
@@ -44,8 +148,8 @@ class AI_Adapter:
 
         try:
             print("[AI Adapter]: Tentando validar a chave como OpenAI...")
-            temp_openai_client = openai.OpenAI(api_key=api_key)
-            temp_openai_client.models.list()
+            with self._get_openai().OpenAI(api_key=api_key) as temp_openai_client:
+                temp_openai_client.models.list()
             print("[AI Adapter]: Chave validada com sucesso como OPENAI_API_KEY.")
             return "OPENAI_API_KEY"
         except Exception as e:
@@ -76,15 +180,55 @@ class AI_Adapter:
         
         return next(response_generator, "")
 
+    async def get_completion_stream_async(self, model_name: str, conversation_history: list, system_instruction: str = None):
+        """Versão asyncio de `get_completion_stream`, com os clientes assíncronos dos provedores."""
+        print(f"[AI Adapter]: Solicitando STREAM assíncrono do modelo: {model_name}")
+        if "gemini" in model_name:
+            response_generator = self._get_gemini_completion_async(model_name, conversation_history, system_instruction, stream=True)
+        elif "gpt" in model_name:
+            response_generator = self._get_openai_completion_async(model_name, conversation_history, system_instruction, stream=True)
+        else:
+            raise NotImplementedError(f"Streaming para '{model_name}' não suportado.")
+
+        try:
+            async for chunk in response_generator:
+                yield chunk
+        finally:
+            await response_generator.aclose()
+
+    async def get_completion_async(self, model_name: str, prompt: str, system_instruction: str = None, json_mode: bool = False) -> str:
+        """Versão asyncio de `get_completion_sync`."""
+        print(f"[AI Adapter]: Solicitando resposta assíncrona do modelo: {model_name}")
+        conversation_history = [{"role": "user", "parts": [prompt]}]
+        if "gemini" in model_name:
+            response_generator = self._get_gemini_completion_async(model_name, conversation_history, system_instruction, stream=False, json_mode=json_mode)
+        elif "gpt" in model_name:
+            response_generator = self._get_openai_completion_async(model_name, conversation_history, system_instruction, stream=False, json_mode=json_mode)
+        else:
+            raise NotImplementedError(f"Chamada assíncrona para '{model_name}' não suportada.")
+
+        try:
+            async for text in response_generator:
+                return text
+            return ""
+        finally:
+            await response_generator.aclose()
+
+    @staticmethod
+    def _build_openai_messages(conversation_history: list, system_instruction: str) -> list:
+        messages = []
+        if system_instruction:
+            messages.append({"role": "system", "content": system_instruction})
+
+        for msg in conversation_history:
+            role = "assistant" if msg["role"] == "model" else "user"
+            content = " ".join(msg["parts"])
+            messages.append({"role": role, "content": content})
+        return messages
+
     def _get_gemini_completion(self, model_name: str, conversation_history: list, system_instruction: str, stream: bool, json_mode: bool = False):
         try:
-            generation_config = genai.GenerationConfig(response_mime_type="application/json") if json_mode else None
-            
-            model = genai.GenerativeModel(
-                model_name=model_name,
-                system_instruction=system_instruction,
-                generation_config=generation_config
-            )
+            model = self._get_gemini_model(model_name, system_instruction, json_mode)
             response = model.generate_content(conversation_history, stream=stream)
 
             if stream:
@@ -101,16 +245,8 @@ class AI_Adapter:
 
     def _get_openai_completion(self, model_name: str, conversation_history: list, system_instruction: str, stream: bool, json_mode: bool = False):
         try:
-            client = openai.OpenAI()
-            
-            messages = []
-            if system_instruction:
-                messages.append({"role": "system", "content": system_instruction})
-            
-            for msg in conversation_history:
-                role = "assistant" if msg["role"] == "model" else "user"
-                content = " ".join(msg["parts"])
-                messages.append({"role": role, "content": content})
+            client = self._get_openai_client()
+            messages = self._build_openai_messages(conversation_history, system_instruction)
 
             response_format = {"type": "json_object"} if json_mode else {"type": "text"}
 
@@ -129,6 +265,50 @@ class AI_Adapter:
                 yield "[STREAM_END]"
             else:
                 yield response.choices[0].message.content
+        except Exception as e:
+            error_message = f"Erro no AI Adapter ao chamar o modelo {model_name}: {e}"
+            print(error_message)
+            raise
+
+    async def _get_gemini_completion_async(self, model_name: str, conversation_history: list, system_instruction: str, stream: bool, json_mode: bool = False):
+        try:
+            model = self._get_gemini_model(model_name, system_instruction, json_mode)
+            response = await model.generate_content_async(conversation_history, stream=stream)
+
+            if stream:
+                async for chunk in response:
+                    if chunk.text:
+                        yield chunk.text
+                yield "[STREAM_END]"
+            else:
+                yield response.text
+        except Exception as e:
+            error_message = f"Erro no AI Adapter ao chamar o modelo {model_name}: {e}"
+            print(error_message)
+            raise
+
+    async def _get_openai_completion_async(self, model_name: str, conversation_history: list, system_instruction: str, stream: bool, json_mode: bool = False):
+        try:
+            client = self._get_async_openai_client()
+            messages = self._build_openai_messages(conversation_history, system_instruction)
+
+            response_format = {"type": "json_object"} if json_mode else {"type": "text"}
+
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                stream=stream,
+                response_format=response_format
+            )
+
+            if stream:
+                async for chunk in response:
+                    content = chunk.choices[0].delta.content or ""
+                    if content:
+                        yield content
+                yield "[STREAM_END]"
+            else:
+                yield response.choices[0].message.content
         except Exception as e:
             error_message = f"Erro no AI Adapter ao chamar o modelo {model_name}: {e}"
             print(error_message)
@@ -0,0 +1,82 @@
+# Arquivo: services_backend/async_runtime.py
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class AsyncRuntime:
+    """
+    Loop asyncio dedicado, numa thread própria, onde correm os turnos de conversa.
+    Os handlers do Socket.IO (threads) entregam-lhe corrotinas com `submit` e ficam
+    livres de imediato; as esperas pelos provedores (classificador, streams) ficam
+    todas multiplexadas neste loop em vez de ocuparem uma thread por conversa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._closed = False
+        self._active = 0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, name="async-runtime", daemon=True)
+            self._thread.start()
+        print("[Async Runtime]: Loop asyncio iniciado.")
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            # Encerramento: cancela os turnos ainda em curso e fecha os geradores assíncronos.
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+    def submit(self, coro) -> Future:
+        """Agenda a corrotina no loop e devolve um Future de `concurrent.futures`."""
+        self.start()
+        with self._lock:
+            if self._closed:
+                coro.close()
+                future = Future()
+                future.set_exception(RuntimeError("O loop asyncio já foi encerrado."))
+                return future
+            self._active += 1
+            self._stats["submitted"] += 1
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future):
+        failed = future.cancelled() or future.exception() is not None
+        if failed and not future.cancelled():
+            print(f"[Async Runtime]: Erro não tratado num turno: {future.exception()}")
+        with self._lock:
+            self._active -= 1
+            self._stats["failed" if failed else "completed"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "active": self._active, "running": self._thread is not None and not self._closed}
+
+    def close(self, timeout: float = 5.0):
+        with self._lock:
+            already_closed = self._closed
+            self._closed = True
+            loop, thread = self._loop, self._thread
+        if thread is None or already_closed:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=timeout)
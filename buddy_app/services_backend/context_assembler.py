@@ -0,0 +1,146 @@
+# Arquivo: services_backend/context_assembler.py
+
+import threading
+from config import Config
+from .utils.token_estimator import estimate_tokens, estimate_message_tokens
+
+
+class ContextAssembler:
+    """
+    Monta o histórico enviado ao modelo dentro de um orçamento de tokens.
+    As mensagens recentes entram literalmente; os trechos mais antigos são
+    substituídos por resumos do SummarizerService, calculados em background
+    uma única vez por trecho e guardados no memory.db.
+    """
+
+    def __init__(self, memory_service, summarizer):
+        self.memory_service = memory_service
+        self.summarizer = summarizer
+        self._compaction_lock = threading.Lock()
+
+    def assemble(self, system_instruction: str = "") -> list:
+        budget = Config.CONTEXT_TOKEN_BUDGET - estimate_tokens(system_instruction)
+        recent_budget = int(budget * (1 - Config.CONTEXT_SUMMARY_BUDGET_RATIO))
+
+        tail_start, tail_messages = self.memory_service.get_history_tail()
+
+        recent_messages = []
+        used_tokens = 0
+        for message in reversed(tail_messages):
+            cost = estimate_message_tokens(message)
+            if len(recent_messages) >= Config.CONTEXT_MIN_RECENT_MESSAGES and used_tokens + cost > recent_budget:
+                break
+            recent_messages.append(message)
+            used_tokens += cost
+        recent_messages.reverse()
+
+        verbatim_start = tail_start + len(tail_messages) - len(recent_messages)
+        if verbatim_start == 0:
+            return recent_messages
+
+        self._schedule_compaction(verbatim_start)
+
+        # Os resumos cobrem apenas trechos completos: as mensagens entre o fim do último
+        # resumo e a janela literal entram literalmente, das mais recentes para as mais
+        # antigas, enquanto houver orçamento. Se o resumidor estiver atrasado e o intervalo
+        # não couber, os resumos ficam de fora para o histórico enviado não ter buracos.
+        summarized_end = max(
+            (s["end"] for s in self.memory_service.get_history_summaries() if s["end"] <= verbatim_start),
+            default=None
+        )
+        if summarized_end is None:
+            return recent_messages
+        gap_messages, verbatim_start = self._fill_gap(summarized_end, verbatim_start, budget - used_tokens)
+        recent_messages = gap_messages + recent_messages
+        used_tokens += sum(estimate_message_tokens(message) for message in gap_messages)
+        if verbatim_start > summarized_end:
+            print(f"[Context Assembler]: Mensagens {summarized_end}-{verbatim_start} por resumir não cabem no orçamento; resumos omitidos.")
+            return recent_messages
+
+        summaries = self._select_summaries(verbatim_start, budget - used_tokens)
+
+        if summaries:
+            summary_text = "\n\n".join(summary["summary"] for summary in summaries)
+            recent_messages.insert(0, {
+                "role": "user",
+                "parts": [f"<RESUMO_DA_CONVERSA_ANTERIOR>\n{summary_text}\n</RESUMO_DA_CONVERSA_ANTERIOR>"]
+            })
+        return recent_messages
+
+    def _fill_gap(self, summarized_end: int, verbatim_start: int, remaining_budget: int) -> tuple:
+        """Lê para trás, em janelas, as mensagens ainda não resumidas que cabem no orçamento."""
+        gap_messages = []
+        while verbatim_start > summarized_end:
+            window_start = max(summarized_end, verbatim_start - Config.CONTEXT_COMPACTION_SPAN_MESSAGES)
+            window = self.memory_service.get_history_range(window_start, verbatim_start)
+            if not window:
+                break
+            for message in reversed(window):
+                cost = estimate_message_tokens(message)
+                if cost > remaining_budget:
+                    gap_messages.reverse()
+                    return gap_messages, verbatim_start
+                gap_messages.append(message)
+                remaining_budget -= cost
+                verbatim_start -= 1
+        gap_messages.reverse()
+        return gap_messages, verbatim_start
+
+    def _select_summaries(self, verbatim_start: int, remaining_budget: int) -> list:
+        """
+        Escolhe, a partir da janela literal e para trás, a cadeia de resumos contíguos
+        que cabe no orçamento; para no primeiro buraco (trechos que ficaram por resumir
+        por causa de CONTEXT_MAX_SUMMARY_SPANS).
+        """
+        by_end = {s["end"]: s for s in self.memory_service.get_history_summaries()}
+        selected = []
+        expected_end = verbatim_start
+        while expected_end in by_end:
+            summary = by_end[expected_end]
+            cost = estimate_tokens(summary["summary"])
+            if cost > remaining_budget:
+                break
+            selected.append(summary)
+            remaining_budget -= cost
+            expected_end = summary["start"]
+        selected.reverse()
+        return selected
+
+    def _schedule_compaction(self, verbatim_start: int):
+        summaries = self.memory_service.get_history_summaries()
+        summarized_end = max((s["end"] for s in summaries), default=0)
+        span = Config.CONTEXT_COMPACTION_SPAN_MESSAGES
+
+        # Para históricos antigos muito longos, resume apenas os trechos mais
+        # próximos da janela literal em vez de percorrer a conversa inteira.
+        first_start = max(summarized_end, verbatim_start - span * Config.CONTEXT_MAX_SUMMARY_SPANS)
+        if verbatim_start - first_start < span:
+            return
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+
+        compaction_thread = threading.Thread(
+            target=self._compact_history,
+            args=(first_start, verbatim_start),
+            daemon=True
+        )
+        compaction_thread.start()
+
+    def _compact_history(self, start_position: int, verbatim_start: int):
+        try:
+            span = Config.CONTEXT_COMPACTION_SPAN_MESSAGES
+            while start_position + span <= verbatim_start:
+                end_position = start_position + span
+                chunk = self.memory_service.get_history_range(start_position, end_position)
+                if not chunk:
+                    break
+                summary = self.summarizer.summarize_conversation_chunk(chunk)
+                if not summary:
+                    break
+                self.memory_service.add_history_summary(start_position, end_position, summary)
+                print(f"[Context Assembler]: Mensagens {start_position}-{end_position} compactadas num resumo.")
+                start_position = end_position
+        except Exception as e:
+            print(f"[Context Assembler]: Erro ao compactar o histórico: {e}")
+        finally:
+            self._compaction_lock.release()
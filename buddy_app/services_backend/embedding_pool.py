@@ -0,0 +1,111 @@
+# Arquivo: services_backend/embedding_pool.py
+
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+_worker_model = None
+
+
+def _init_worker(model_name: str):
+    global _worker_model
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _worker_dimension() -> int:
+    return _worker_model.get_sentence_embedding_dimension()
+
+
+def _worker_encode(texts: list) -> tuple:
+    """Calcula os vetores no processo filho e devolve-os num bloco de memória partilhada."""
+    vectors = np.ascontiguousarray(_worker_model.encode(texts), dtype=np.float32)
+    block = shared_memory.SharedMemory(create=True, size=max(vectors.nbytes, 1))
+    np.ndarray(vectors.shape, dtype=np.float32, buffer=block.buf)[:] = vectors
+    name = block.name
+    block.close()
+    return name, vectors.shape
+
+
+def _worker_encode_with_options(texts, options: dict):
+    # Com opções (tensores, normalização, batch_size...) o resultado pode não ser um array
+    # float32: volta tal como o modelo o devolve, serializado pelo pipe.
+    return _worker_model.encode(texts, **options)
+
+
+def _read_shared_vectors(name: str, shape: tuple):
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.float32, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+
+class ProcessEmbeddingModel:
+    """
+    Mantém o SentenceTransformer em processos dedicados, fora do GIL das threads que
+    atendem o Socket.IO. Os vetores voltam por memória partilhada (só o nome do bloco
+    e a forma passam pelo pipe). Expõe a mesma interface do modelo, mais `encode_async`.
+
+    Os processos "spawn" reimportam o __main__ do servidor: com `python -m flask run`
+    é o do próprio Flask, que não monta a aplicação. Se um processo morrer, o pool é
+    recriado no pedido seguinte.
+    """
+
+    def __init__(self, model_name: str, workers: int):
+        self.model_name = model_name
+        self.workers = workers
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._dimension = self._submit(_worker_dimension).result()
+        print(f"[Embedding Pool]: Pool de {workers} processo(s) com o modelo '{model_name}' pronto.")
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_name,)
+        )
+
+    def _submit(self, fn, *args) -> Future:
+        with self._executor_lock:
+            try:
+                return self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                print("[Embedding Pool]: Pool de processos quebrado; a recriar os processos.")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                return self._executor.submit(fn, *args)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dimension
+
+    def encode_async(self, texts: list) -> Future:
+        result = Future()
+        remote = self._submit(_worker_encode, list(texts))
+
+        def _on_done(remote_future):
+            try:
+                name, shape = remote_future.result()
+                result.set_result(_read_shared_vectors(name, shape))
+            except Exception as e:
+                result.set_exception(e)
+
+        remote.add_done_callback(_on_done)
+        return result
+
+    def encode(self, texts, **kwargs):
+        if kwargs:
+            return self._submit(_worker_encode_with_options, texts, kwargs).result()
+        if isinstance(texts, str):
+            return self.encode_async([texts]).result()[0]
+        return self.encode_async(texts).result()
+
+    def close(self):
+        with self._executor_lock:
+            self._executor.shutdown(wait=True, cancel_futures=True)
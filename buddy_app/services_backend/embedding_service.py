@@ -0,0 +1,225 @@
+# Arquivo: services_backend/embedding_service.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from config import Config
+from .utils.metrics import EMBEDDING_BATCH_SECONDS, EMBEDDING_BATCH_SIZE
+
+
+class EmbeddingService:
+    """
+    Agrupa os pedidos de embedding feitos em simultâneo por várias threads (usuários,
+    arquivamento) num único `encode` por lote. Quem chama recebe um Future; `encode`
+    mantém a interface síncrona do SentenceTransformer.
+
+    Com uma única thread a pedir, o lote parte de imediato; o pequeno tempo de espera
+    só se aplica quando já há outros pedidos na fila. Se o modelo tiver `encode_async`
+    (ProcessEmbeddingModel), ficam até `model.workers` lotes em curso ao mesmo tempo.
+
+    O modelo é criado por `model_factory` na própria thread do serviço, no primeiro
+    uso ou quando `start()` é chamado pelo aquecimento da aplicação.
+    """
+
+    def __init__(self, model_factory, max_batch_size: int = None, max_wait_ms: float = None):
+        self._model_factory = model_factory
+        self.model = None
+        self.max_batch_size = max_batch_size or Config.EMBEDDING_BATCH_MAX_SIZE
+        self.max_wait_seconds = (Config.EMBEDDING_BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self._dimension = None
+        self._queue = queue.Queue()
+        self._async_model = False
+        self._inflight = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "batches": 0}
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._load_error = None
+        self._worker = None
+
+    def start(self):
+        with self._start_lock:
+            if self._worker is None and not self._closed:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def state(self) -> str:
+        if self._load_error is not None:
+            return "failed"
+        if self._ready.is_set():
+            return "ready"
+        return "loading" if self._worker is not None else "idle"
+
+    def _load_model(self):
+        try:
+            print("[Embedding Service]: A carregar o modelo de embeddings...")
+            self.model = self._model_factory()
+            self._dimension = self.model.get_sentence_embedding_dimension()
+            self._async_model = hasattr(self.model, "encode_async")
+            self._inflight = threading.Semaphore(getattr(self.model, "workers", 1))
+            print("[Embedding Service]: Modelo de embeddings pronto.")
+            return True
+        except Exception as e:
+            self._load_error = e
+            print(f"[Embedding Service]: Falha ao carregar o modelo de embeddings: {e}")
+            return False
+        finally:
+            self._ready.set()
+
+    def _wait_until_ready(self):
+        self.start()
+        self._ready.wait()
+        if self._load_error is not None:
+            raise RuntimeError(f"O modelo de embeddings não pôde ser carregado: {self._load_error}")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        self._wait_until_ready()
+        return self._dimension
+
+    def submit(self, texts: list) -> Future:
+        future = Future()
+        if self._closed:
+            future.set_exception(RuntimeError("O serviço de embeddings já foi encerrado."))
+            return future
+        if self._load_error is not None:
+            future.set_exception(RuntimeError(f"O modelo de embeddings não pôde ser carregado: {self._load_error}"))
+            return future
+        self.start()
+        if not texts:
+            self._wait_until_ready()
+            future.set_result(np.zeros((0, self._dimension), dtype=np.float32))
+            return future
+        self._queue.put((list(texts), future))
+        if self._load_error is not None:
+            # O carregamento falhou enquanto o pedido entrava na fila.
+            self._fail_pending()
+        return future
+
+    def encode(self, texts, **kwargs):
+        if kwargs:
+            self._wait_until_ready()
+            return self.model.encode(texts, **kwargs)
+        if isinstance(texts, str):
+            return self.submit([texts]).result()[0]
+        return self.submit(texts).result()
+
+    def _collect_batch(self, first_request) -> list:
+        batch = [first_request]
+        size = len(first_request[0])
+        deadline = None
+        while size < self.max_batch_size:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                if len(batch) == 1 or self.max_wait_seconds <= 0:
+                    break
+                # Já há concorrência: espera um pouco por mais pedidos antes de fechar o lote.
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_wait_seconds
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        if self._load_model():
+            self._batch_loop()
+        else:
+            self._fail_pending()
+
+    def _batch_loop(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                self._fail_pending()
+                return
+            if self._async_model:
+                # Enquanto todos os processos estão ocupados, os pedidos acumulam-se no próximo lote.
+                self._inflight.acquire()
+            batch = self._collect_batch(request)
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            EMBEDDING_BATCH_SIZE.observe(len(texts))
+            started_at = time.perf_counter()
+            if not self._async_model:
+                try:
+                    vectors = self.model.encode(texts)
+                    EMBEDDING_BATCH_SECONDS.observe(time.perf_counter() - started_at)
+                    self._complete_batch(batch, vectors)
+                except Exception as e:
+                    self._fail_batch(batch, e)
+                continue
+
+            try:
+                remote = self.model.encode_async(texts)
+            except Exception as e:
+                self._inflight.release()
+                self._fail_batch(batch, e)
+                continue
+            remote.add_done_callback(lambda done, batch=batch, started_at=started_at: self._on_remote_done(batch, done, started_at))
+
+    def _on_remote_done(self, batch: list, done: Future, started_at: float):
+        self._inflight.release()
+        EMBEDDING_BATCH_SECONDS.observe(time.perf_counter() - started_at)
+        try:
+            self._complete_batch(batch, done.result())
+        except Exception as e:
+            self._fail_batch(batch, e)
+
+    def _complete_batch(self, batch: list, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        offset = 0
+        for request_texts, future in batch:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+        with self._stats_lock:
+            self._stats["requests"] += len(batch)
+            self._stats["texts"] += offset
+            self._stats["batches"] += 1
+
+    @staticmethod
+    def _fail_batch(batch: list, error: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _fail_pending(self):
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request[1].set_exception(RuntimeError("O serviço de embeddings não está disponível."))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = self._stats["batches"]
+            return {
+                **self._stats,
+                "avg_batch_texts": self._stats["texts"] / batches if batches else 0.0,
+                "queued": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+            }
+
+    def close(self):
+        with self._start_lock:
+            self._closed = True
+            worker = self._worker
+        if worker is None:
+            return
+        self._queue.put(None)
+        worker.join(timeout=5)
+        if self.model is not None and hasattr(self.model, "close"):
+            self.model.close()
@@ -0,0 +1,160 @@
+# Arquivo: services_backend/history_store.py
+
+import os
+import json
+import threading
+
+
+class HistoryStore:
+    """
+    Histórico de curto prazo (Nível 1) guardado na tabela `history` do memory.db
+    do usuário. Cada mensagem é uma linha, gravada em lotes numa transação; ler as
+    últimas N mensagens percorre apenas o fim do índice da chave primária.
+    """
+
+    def __init__(self, db, legacy_json_path: str = None):
+        self.db = db
+        self._create_history_table()
+        if legacy_json_path:
+            self._migrate_legacy_json(legacy_json_path)
+        # Limites dos ids, para traduzir posições em ids sem percorrer a tabela com OFFSET.
+        self._bounds_lock = threading.Lock()
+        self._load_id_bounds()
+
+    def _load_id_bounds(self):
+        with self.db.connection() as conn:
+            first_id, last_id, count = conn.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM history").fetchone()
+        with self._bounds_lock:
+            self._first_id, self._last_id, self._count = first_id, last_id, count
+
+    def _update_id_bounds(self, conn, appended: int):
+        first_id, last_id = conn.execute("SELECT MIN(id), MAX(id) FROM history").fetchone()
+        with self._bounds_lock:
+            self._first_id, self._last_id = first_id, last_id
+            self._count += appended
+
+    def _position_to_id(self, position: int):
+        """Id da mensagem na posição dada, se os ids forem contíguos (o histórico só cresce); senão None."""
+        with self._bounds_lock:
+            if self._first_id is None or self._last_id - self._first_id + 1 != self._count:
+                return None
+            return self._first_id + position
+
+    def _create_history_table(self):
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    role TEXT NOT NULL,
+                    parts TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS history_summaries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    start_position INTEGER NOT NULL,
+                    end_position INTEGER NOT NULL,
+                    summary TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+
+    def _migrate_legacy_json(self, json_path: str):
+        """Importa o antigo history.json numa única transação e renomeia o ficheiro."""
+        if not os.path.exists(json_path):
+            return
+
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+                legacy_history = json.loads(content) if content else []
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[History Store]: Não foi possível ler '{os.path.basename(json_path)}' para migração: {e}")
+            return
+
+        # Entradas sem `role` ou `parts` (ficheiro editado à mão ou corrompido) são ignoradas.
+        rows = [
+            (msg['role'], json.dumps(msg['parts'], ensure_ascii=False))
+            for msg in (legacy_history if isinstance(legacy_history, list) else [])
+            if isinstance(msg, dict) and isinstance(msg.get('role'), str) and isinstance(msg.get('parts'), list)
+        ]
+        skipped = (len(legacy_history) if isinstance(legacy_history, list) else 1) - len(rows)
+        if skipped:
+            print(f"[History Store]: {skipped} entradas inválidas ignoradas em '{os.path.basename(json_path)}'.")
+
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM history")
+            if cursor.fetchone()[0] == 0 and rows:
+                cursor.executemany("INSERT INTO history (role, parts) VALUES (?, ?)", rows)
+                print(f"[History Store]: {len(rows)} mensagens migradas de '{os.path.basename(json_path)}'.")
+            conn.commit()
+
+        os.replace(json_path, json_path + '.migrated')
+
+    def append_many(self, messages: list):
+        """Grava um lote de mensagens numa única transação (o MemoryService junta as escritas em lotes)."""
+        if not messages:
+            return
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO history (role, parts) VALUES (?, ?)",
+                [(msg['role'], json.dumps(msg['parts'], ensure_ascii=False)) for msg in messages]
+            )
+            conn.commit()
+            self._update_id_bounds(conn, len(messages))
+
+    def get_last(self, limit: int = None) -> list:
+        """Devolve as últimas `limit` mensagens (ou todas) em ordem cronológica."""
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            if limit is None:
+                cursor.execute("SELECT role, parts FROM history ORDER BY id ASC")
+                rows = cursor.fetchall()
+            else:
+                cursor.execute("SELECT role, parts FROM history ORDER BY id DESC LIMIT ?", (limit,))
+                rows = cursor.fetchall()[::-1]
+            return [{"role": role, "parts": json.loads(parts)} for role, parts in rows]
+
+    def get_range(self, start_position: int, end_position: int) -> list:
+        """Devolve as mensagens nas posições [start_position, end_position) do histórico."""
+        start_id = self._position_to_id(start_position)
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            if start_id is not None:
+                # Busca pela chave primária: páginas antigas custam o mesmo que as recentes.
+                cursor.execute(
+                    "SELECT role, parts FROM history WHERE id >= ? AND id < ? ORDER BY id ASC",
+                    (start_id, start_id + end_position - start_position)
+                )
+            else:
+                cursor.execute(
+                    "SELECT role, parts FROM history ORDER BY id ASC LIMIT ? OFFSET ?",
+                    (end_position - start_position, start_position)
+                )
+            return [{"role": role, "parts": json.loads(parts)} for role, parts in cursor.fetchall()]
+
+    def get_summaries(self) -> list:
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT start_position, end_position, summary FROM history_summaries ORDER BY end_position ASC")
+            return [{"start": start, "end": end, "summary": summary} for start, end, summary in cursor.fetchall()]
+
+    def add_summary(self, start_position: int, end_position: int, summary: str):
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO history_summaries (start_position, end_position, summary) VALUES (?, ?, ?)",
+                (start_position, end_position, summary)
+            )
+            conn.commit()
+
+    def count(self) -> int:
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM history")
+            return cursor.fetchone()[0]
@@ -0,0 +1,259 @@
+# Arquivo: services_backend/intent_classifier.py
+
+import os
+import json
+import threading
+import numpy as np
+from config import Config
+from models import ActionPlan
+from .utils.sqlite_manager import SQLiteConnectionManager
+
+
+class IntentClassifier:
+    """
+    Classificador local (kNN sobre os embeddings) treinado com os ActionPlans que o
+    classificador LLM já devolveu, partilhado por todos os usuários. Só guarda o
+    vetor da mensagem e os rótulos do plano, nunca o texto. A especialidade e a
+    necessidade de memória são votadas por todos os vizinhos; as tags só pelos
+    exemplos do próprio usuário, para não passarem de um usuário para outro.
+
+    `predict` devolve um ActionPlan quando os vizinhos concordam o suficiente
+    (INTENT_CLASSIFIER_CONFIDENCE_THRESHOLD) e há tags do próprio usuário para o
+    plano; caso contrário devolve None e o orquestrador recorre ao LLM. Os planos
+    locais não trazem factos: o orquestrador extrai-os à parte, em segundo plano.
+    """
+
+    def __init__(self, embedding_model, db_path: str = None):
+        self.embedding_model = embedding_model
+        # A base de exemplos só é aberta (e criada) no primeiro uso ou no aquecimento.
+        self.db_path = db_path or Config.INTENT_CLASSIFIER_DB_PATH
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._examples = None
+        # Vetores dos exemplos num buffer com folga: as linhas válidas começam em
+        # `_matrix_start`, e acrescentar um exemplo não copia a matriz inteira.
+        self._matrix = None
+        self._matrix_start = 0
+        self._stats = {
+            "local_predictions": 0,
+            "llm_fallbacks": 0,
+            "tagless_fallbacks": 0,
+            "shadow_comparisons": 0,
+            "specialty_agreements": 0,
+            "memory_agreements": 0,
+        }
+
+    def _get_db(self):
+        with self._db_lock:
+            if self._db is None:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                db = SQLiteConnectionManager(self.db_path)
+                self._create_table(db)
+                self._db = db
+            return self._db
+
+    @staticmethod
+    def _create_table(db):
+        with db.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS action_plan_examples (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    specialty TEXT NOT NULL,
+                    needs_search INTEGER NOT NULL,
+                    needs_long_term_memory INTEGER NOT NULL,
+                    tags TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    user_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(action_plan_examples)")}
+            if "user_id" not in columns:
+                # Exemplos antigos ficam sem dono: continuam a votar, mas nunca nas tags.
+                conn.execute("ALTER TABLE action_plan_examples ADD COLUMN user_id INTEGER")
+            conn.commit()
+
+    def _ensure_loaded(self):
+        if self._examples is not None:
+            return
+        with self._get_db().connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT specialty, needs_search, needs_long_term_memory, tags, embedding, user_id
+                FROM action_plan_examples ORDER BY id DESC LIMIT ?
+                """,
+                (Config.INTENT_CLASSIFIER_MAX_EXAMPLES,)
+            ).fetchall()
+        self._examples = [
+            {
+                "specialty": specialty,
+                "needs_search": bool(needs_search),
+                "needs_long_term_memory": bool(needs_long_term_memory),
+                "tags": json.loads(tags),
+                "vector": np.frombuffer(blob, dtype=np.float32),
+                "user_id": user_id,
+            }
+            for specialty, needs_search, needs_long_term_memory, tags, blob, user_id in reversed(rows)
+        ]
+        self._matrix = None
+        self._matrix_start = 0
+        print(f"[Intent Classifier]: {len(self._examples)} exemplos de planos de ação carregados.")
+
+    def warm_up(self):
+        """Abre a base e carrega os exemplos antes do primeiro pedido (aquecimento da aplicação)."""
+        with self._lock:
+            self._ensure_loaded()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _embed(self, user_prompt: str):
+        return self._normalize(self.embedding_model.encode([user_prompt])[0])
+
+    def _active_matrix(self):
+        if self._matrix is None:
+            vectors = [example["vector"] for example in self._examples]
+            self._matrix = np.empty((max(2 * len(vectors), 64), len(vectors[0])), dtype=np.float32)
+            self._matrix[:len(vectors)] = vectors
+            self._matrix_start = 0
+        return self._matrix[self._matrix_start:self._matrix_start + len(self._examples)]
+
+    def _append_vector(self, vector):
+        if self._matrix is None:
+            return
+        end = self._matrix_start + len(self._examples)
+        if end == len(self._matrix):
+            # Buffer cheio: as linhas válidas passam para um novo buffer com o dobro da folga.
+            live = self._matrix[self._matrix_start:end]
+            self._matrix = np.empty((max(2 * len(live), 64), self._matrix.shape[1]), dtype=np.float32)
+            self._matrix[:len(live)] = live
+            self._matrix_start, end = 0, len(live)
+        self._matrix[end] = vector
+
+    def predict(self, user_prompt: str, user_id=None) -> ActionPlan | None:
+        query = self._embed(user_prompt)
+        with self._lock:
+            self._ensure_loaded()
+            if len(self._examples) < Config.INTENT_CLASSIFIER_MIN_EXAMPLES:
+                self._stats["llm_fallbacks"] += 1
+                return None
+            similarities = self._active_matrix() @ query
+            k = min(Config.INTENT_CLASSIFIER_K, len(similarities))
+            nearest = np.argpartition(-similarities, k - 1)[:k]
+            neighbours = [
+                (self._examples[i], float(similarities[i])) for i in nearest
+                if similarities[i] >= Config.INTENT_CLASSIFIER_MIN_SIMILARITY
+            ]
+
+        if not neighbours:
+            with self._lock:
+                self._stats["llm_fallbacks"] += 1
+            return None
+
+        total_weight = sum(weight for _, weight in neighbours)
+
+        def vote(key):
+            scores = {}
+            for example, weight in neighbours:
+                scores[example[key]] = scores.get(example[key], 0.0) + weight
+            winner = max(scores, key=scores.get)
+            return winner, scores[winner] / total_weight
+
+        specialty, specialty_share = vote("specialty")
+        needs_memory, memory_share = vote("needs_long_term_memory")
+        needs_search, _ = vote("needs_search")
+        confidence = min(specialty_share, memory_share)
+
+        own_neighbours = [(example, weight) for example, weight in neighbours if user_id is not None and example["user_id"] == user_id]
+        own_weight = sum(weight for _, weight in own_neighbours)
+        tag_scores = {}
+        for example, weight in own_neighbours:
+            for tag in example["tags"]:
+                tag_scores[tag] = tag_scores.get(tag, 0.0) + weight
+        tags = [tag for tag, score in sorted(tag_scores.items(), key=lambda item: item[1], reverse=True) if score / own_weight >= 0.5][:3]
+
+        with self._lock:
+            if confidence < Config.INTENT_CLASSIFIER_CONFIDENCE_THRESHOLD:
+                self._stats["llm_fallbacks"] += 1
+                return None
+            if not tags:
+                # Sem tags o contextualizador, a bancada e o pré-filtro do RAG ficariam parados neste turno.
+                self._stats["llm_fallbacks"] += 1
+                self._stats["tagless_fallbacks"] += 1
+                return None
+            self._stats["local_predictions"] += 1
+
+        print(f"[Intent Classifier]: Plano local (confiança {confidence:.2f}, {len(neighbours)} vizinhos).")
+        return ActionPlan(
+            specialty=specialty,
+            needs_search=needs_search,
+            needs_long_term_memory=needs_memory,
+            tags=tags
+        )
+
+    def record(self, user_prompt: str, plan: ActionPlan, user_id=None):
+        """Guarda o plano devolvido pelo LLM como exemplo de treino."""
+        vector = self._embed(user_prompt)
+        with self._get_db().connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO action_plan_examples (specialty, needs_search, needs_long_term_memory, tags, embedding, user_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (plan.specialty, int(plan.needs_search), int(plan.needs_long_term_memory), json.dumps(plan.tags), vector.tobytes(), user_id)
+            )
+            conn.commit()
+        with self._lock:
+            if self._examples is None:
+                return
+            self._append_vector(vector)
+            self._examples.append({
+                "specialty": plan.specialty,
+                "needs_search": plan.needs_search,
+                "needs_long_term_memory": plan.needs_long_term_memory,
+                "tags": list(plan.tags),
+                "vector": vector,
+                "user_id": user_id,
+            })
+            if len(self._examples) > Config.INTENT_CLASSIFIER_MAX_EXAMPLES:
+                del self._examples[0]
+                if self._matrix is not None:
+                    self._matrix_start += 1
+
+    def record_shadow_comparison(self, local_plan: ActionPlan, llm_plan: ActionPlan):
+        """Compara o plano local com o do LLM (executado em sombra) para afinar o limiar."""
+        specialty_agrees = local_plan.specialty == llm_plan.specialty
+        memory_agrees = local_plan.needs_long_term_memory == llm_plan.needs_long_term_memory
+        with self._lock:
+            self._stats["shadow_comparisons"] += 1
+            self._stats["specialty_agreements"] += int(specialty_agrees)
+            self._stats["memory_agreements"] += int(memory_agrees)
+            comparisons = self._stats["shadow_comparisons"]
+            specialty_rate = self._stats["specialty_agreements"] / comparisons
+            memory_rate = self._stats["memory_agreements"] / comparisons
+        print(
+            f"[Intent Classifier]: Sombra LLM -> especialidade {'igual' if specialty_agrees else 'diferente'} "
+            f"({local_plan.specialty}/{llm_plan.specialty}), memória {'igual' if memory_agrees else 'diferente'}. "
+            f"Concordância acumulada: especialidade {specialty_rate:.0%}, memória {memory_rate:.0%}."
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            comparisons = self._stats["shadow_comparisons"]
+            predictions = self._stats["local_predictions"] + self._stats["llm_fallbacks"]
+            return {
+                **self._stats,
+                "examples": len(self._examples) if self._examples is not None else None,
+                "local_rate": self._stats["local_predictions"] / predictions if predictions else 0.0,
+                "specialty_agreement_rate": self._stats["specialty_agreements"] / comparisons if comparisons else None,
+                "memory_agreement_rate": self._stats["memory_agreements"] / comparisons if comparisons else None,
+                "confidence_threshold": Config.INTENT_CLASSIFIER_CONFIDENCE_THRESHOLD,
+            }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
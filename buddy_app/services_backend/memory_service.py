@@ -1,232 +1,822 @@
-# Arquivo: services_backend/memory_service.py (versão multi-usuário)
-
-import os
-import json
-import numpy as np
-import faiss
-import sqlite3
-from config import Config 
-
-class MemoryService:
-    def __init__(self, user_id: int, embedding_model, summarizer, tagger, segmenter):
-        if not user_id:
-            raise ValueError("O ID do usuário é necessário para inicializar o MemoryService.")
-        
-        self.user_data_path = os.path.join(Config.BUDDY_DATA_BASE_PATH, str(user_id))
-        self._ensure_user_directory_exists()
-
-        self.config_path = os.path.join(self.user_data_path, 'buddy_config.json')
-        self.history_path = os.path.join(self.user_data_path, 'history.json')
-        self.index_path = os.path.join(self.user_data_path, 'memory.faiss')
-        self.db_path = os.path.join(self.user_data_path, 'memory.db')
-
-        self._ensure_files_exist()
-        
-        self.embedding_model = embedding_model
-        
-        self._create_memory_table()
-        
-        try:
-            self.index = faiss.read_index(self.index_path)
-            print(f"[Memory Service para Usuário {user_id}]: Índice FAISS carregado com {self.index.ntotal} memórias.")
-        except RuntimeError:
-
-            embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
-            self.index = faiss.IndexFlatL2(embedding_dim)
-            print(f"[Memory Service para Usuário {user_id}]: Novo índice FAISS criado.")
-        
-        self.summarizer = summarizer
-        self.tagger = tagger
-        self.segmenter = segmenter
-        
-        self.predictive_tags_accumulator = []
-        self.session_tags_cache = []
-        
-        self.workbench = []
-        print(f"[Memory Service para Usuário {user_id}]: Bancada de Trabalho (Nível 2) inicializada.")
-
-    def _ensure_user_directory_exists(self):
-        """Garante que o diretório de dados do usuário exista."""
-        if not os.path.exists(self.user_data_path):
-            os.makedirs(self.user_data_path)
-            print(f"[Memory Service]: Diretório criado para o usuário em: {self.user_data_path}")
-
-    def _get_db_connection(self):
-        return sqlite3.connect(self.db_path)
-
-    def _create_memory_table(self):
-        conn = self._get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS memories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    summary TEXT NOT NULL,
-                    tags TEXT,
-                    original_chunk TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-        finally:
-            conn.close()
-
-    def get_master_tag_list(self) -> list:
-        conn = self._get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT tags FROM memories")
-            master_tags = set()
-            for row in cursor.fetchall():
-                if row[0]:
-                    tags = json.loads(row[0])
-                    master_tags.update(tags)
-            return sorted(list(master_tags))
-        finally:
-            conn.close()
-
-    def add_block_to_workbench(self, block_data: dict):
-        print(f"[Memory Service]: Bloco de tópico '{block_data.get('tags', [])}' adicionado à Bancada de Trabalho.")
-        self.workbench.append(block_data)
-
-    def process_conversation_block_for_archiving(self, block_data: dict):
-        try:
-            print(f"[Memory Service]: Recebido bloco para arquivamento em background.")
-            conversation_chunk = block_data.get("block", [])
-            
-            if not conversation_chunk or len(conversation_chunk) < 2:
-                print("[Memory Service]: Bloco recebido é muito curto para ser processado. Ignorando.")
-                return
-
-            segmented_topics = self.segmenter.segment_conversation_by_topic(conversation_chunk)
-
-            for topic_name, topic_chunk in segmented_topics.items():
-                print(f"[Memory Service]: A processar o tópico '{topic_name}' do bloco...")
-                if not topic_chunk or len(topic_chunk) < 2:
-                    continue
-                summary = self.summarizer.summarize_conversation_chunk(topic_chunk)
-                if summary:
-                    master_tags = self.get_master_tag_list()
-                    final_tags = self.tagger.refine_and_consolidate_tags(
-                        summary=summary, 
-                        candidate_tags=self.predictive_tags_accumulator,
-                        session_tags=self.session_tags_cache,
-                        master_tag_list=master_tags
-                    )
-                    
-                    for tag in final_tags:
-                        if tag not in self.session_tags_cache:
-                            self.session_tags_cache.append(tag)
-                    
-                    self.add_to_long_term_memory(summary, final_tags, topic_chunk)
-            
-            self.predictive_tags_accumulator = []
-            print(f"[Memory Service]: Arquivamento do bloco concluído.")
-        
-        except Exception as e:
-            print(f"[Memory Service]: ERRO CRÍTICO DURANTE ARQUIVAMENTO EM BACKGROUND: {e}")
-
-    def add_to_long_term_memory(self, summary: str, tags: list, original_chunk: list):
-        conn = self._get_db_connection()
-        try:
-            summary_embedding = self.embedding_model.encode([summary])
-            self.index.add(np.array(summary_embedding, dtype=np.float32))
-            
-            tags_json = json.dumps(tags)
-            chunk_json = json.dumps(original_chunk, ensure_ascii=False)
-            
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO memories (summary, tags, original_chunk) VALUES (?, ?, ?)",
-                (summary, tags_json, chunk_json)
-            )
-            conn.commit()
-            
-            faiss.write_index(self.index, self.index_path)
-            print(f"[Memory Service]: Nova memória arquivada no FAISS e DB. Total: {self.index.ntotal}")
-        except Exception as e:
-            print(f"Erro ao salvar na memória de longo prazo: {e}")
-        finally:
-            conn.close()
-            
-    def retrieve_relevant_memories(self, user_prompt: str, n_results: int = 3) -> str:
-        conn = self._get_db_connection()
-        try:
-            if self.index.ntotal == 0:
-                return ""
-            prompt_embedding = self.embedding_model.encode([user_prompt])
-            distances, indices = self.index.search(np.array(prompt_embedding, dtype=np.float32), n_results)
-            
-            valid_indices = [i for i in indices[0] if i != -1]
-            if not valid_indices:
-                return ""
-            
-            db_ids = [i + 1 for i in valid_indices]
-            placeholders = ','.join('?' for _ in db_ids)
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT summary, tags FROM memories WHERE id IN ({placeholders})", db_ids)
-            
-            results = cursor.fetchall()
-            found_memories = "\n".join(
-                f"- Lembrete de uma conversa anterior (Tópicos: {', '.join(json.loads(res[1])) if res[1] else 'N/A'}): {res[0]}"
-                for res in results
-            )
-            print(f"[Memory Service]: Memórias relevantes recuperadas do FAISS e DB.")
-            return found_memories
-        except Exception as e:
-            print(f"Erro ao recuperar memórias: {e}")
-            return "Ocorreu um erro enquanto eu tentava aceder à minha memória de longo prazo."
-        finally:
-            conn.close()
-
-    def _ensure_files_exist(self):
-        files_to_check = {
-            self.config_path: '{}',
-            self.history_path: '[]'
-        }
-        for path, default_content in files_to_check.items():
-            if not os.path.exists(path):
-                print(f"[Memory Service]: Ficheiro '{os.path.basename(path)}' não encontrado. A criar um novo.")
-                with open(path, 'w', encoding='utf-8') as f:
-                     f.write(default_content)
-                     
-    def add_predictive_tags(self, tags: list):
-        self.predictive_tags_accumulator.extend(tags)
-        self.predictive_tags_accumulator = list(set(self.predictive_tags_accumulator))
-    
-    def add_to_history(self, message: dict):
-        history = self.get_short_term_memory()
-        history.append(message)
-        self._save_json(self.history_path, history)
-        
-    def load_facts(self):
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                return json.loads(content) if content else {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Erro ao carregar o ficheiro de factos: {e}")
-            return {}
-            
-    def add_fact(self, new_facts: dict):
-        if not isinstance(new_facts, dict):
-            return
-        current_facts = self.load_facts()
-        current_facts.update(new_facts)
-        self._save_json(self.config_path, current_facts)
-        
-    def get_short_term_memory(self):
-        try:
-            with open(self.history_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                return json.loads(content) if content else []
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Erro ao carregar o ficheiro de histórico: {e}")
-            return []
-            
-    def _save_json(self, file_path: str, data: list | dict):
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except IOError as e:
-            print(f"Erro ao salvar o ficheiro {os.path.basename(file_path)}: {e}")
\ No newline at end of file
+# Arquivo: services_backend/memory_service.py (versão multi-usuário)
+
+import os
+import re
+import json
+import numpy as np
+import sqlite3
+import threading
+from collections import deque
+from config import Config 
+from .history_store import HistoryStore
+from .utils.sqlite_manager import SQLiteConnectionManager
+from .vector_index import VectorIndex
+from .utils.rank_fusion import reciprocal_rank_fusion, maximal_marginal_relevance
+from .utils.token_estimator import estimate_tokens
+from .utils.metrics import MEMORY_IO_SECONDS, ARCHIVE_SECONDS, ARCHIVED_MEMORIES_TOTAL
+from models import RetrievedMemory
+
+class MemoryService:
+    def __init__(self, user_id: int, embedding_model, summarizer, tagger, segmenter):
+        if not user_id:
+            raise ValueError("O ID do usuário é necessário para inicializar o MemoryService.")
+        
+        self.user_id = user_id
+        self.user_data_path = os.path.join(Config.BUDDY_DATA_BASE_PATH, str(user_id))
+        self._ensure_user_directory_exists()
+
+        self.config_path = os.path.join(self.user_data_path, 'buddy_config.json')
+        self.history_path = os.path.join(self.user_data_path, 'history.json')
+        self.index_path = os.path.join(self.user_data_path, 'memory.faiss')
+        self.db_path = os.path.join(self.user_data_path, 'memory.db')
+
+        self._ensure_files_exist()
+        
+        self.embedding_model = embedding_model
+        
+        self.db = SQLiteConnectionManager(self.db_path)
+        self._memory_write_lock = threading.Lock()
+        embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
+        self.vector_index = VectorIndex(self.index_path, embedding_dim)
+        self._create_memory_table()
+        with self.db.connection() as conn:
+            self._has_fts = self._fts_enabled(conn.cursor())
+        self.history_store = HistoryStore(self.db, legacy_json_path=self.history_path)
+
+        self._state_lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._load_state_cache()
+        self._load_master_tags()
+        
+        self.reconcile_vector_index()
+        print(f"[Memory Service para Usuário {user_id}]: Índice FAISS carregado com {self.vector_index.ntotal} memórias.")
+        self._index_rebuild_thread = None
+        self._index_rebuild_lock = threading.Lock()
+        self._schedule_vector_index_rebuild()
+        
+        self.summarizer = summarizer
+        self.tagger = tagger
+        self.segmenter = segmenter
+        
+        self.predictive_tags_accumulator = []
+        self.session_tags_cache = []
+        
+        self.workbench = []
+        print(f"[Memory Service para Usuário {user_id}]: Bancada de Trabalho (Nível 2) inicializada.")
+
+        self._closed = False
+        self._flush_wakeup = threading.Event()
+        self._flusher_thread = threading.Thread(target=self._background_flush_loop, daemon=True)
+        self._flusher_thread.start()
+
+    def _ensure_user_directory_exists(self):
+        """Garante que o diretório de dados do usuário exista."""
+        if not os.path.exists(self.user_data_path):
+            os.makedirs(self.user_data_path)
+            print(f"[Memory Service]: Diretório criado para o usuário em: {self.user_data_path}")
+
+    def _create_memory_table(self):
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS memories (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    summary TEXT NOT NULL,
+                    tags TEXT,
+                    original_chunk TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tags (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS memory_tags (
+                    memory_id INTEGER NOT NULL REFERENCES memories(id) ON DELETE CASCADE,
+                    tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+                    PRIMARY KEY (memory_id, tag_id)
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_memory_tags_tag ON memory_tags (tag_id, memory_id)")
+            conn.commit()
+            self._run_schema_migrations(conn)
+
+    def _run_schema_migrations(self, conn):
+        """Migrações incrementais do memory.db, controladas por PRAGMA user_version."""
+        cursor = conn.cursor()
+        schema_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+        if schema_version < 1:
+            # v1: a coluna JSON memories.tags passa a ser indexada em tags/memory_tags.
+            cursor.execute("SELECT id, tags FROM memories WHERE tags IS NOT NULL")
+            for memory_id, tags_json in cursor.fetchall():
+                try:
+                    tags = json.loads(tags_json)
+                except json.JSONDecodeError:
+                    continue
+                self._link_memory_tags(cursor, memory_id, tags)
+            cursor.execute("PRAGMA user_version = 1")
+            conn.commit()
+            print("[Memory Service]: Tags das memórias migradas para o índice normalizado.")
+
+        if schema_version < 2:
+            # v2: cada memória guarda o seu embedding, para o índice FAISS poder ser
+            # reparado ou reconstruído sem voltar a chamar o modelo.
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(memories)").fetchall()]
+            if 'embedding' not in columns:
+                cursor.execute("ALTER TABLE memories ADD COLUMN embedding BLOB")
+            legacy_vectors = self.vector_index.legacy_vectors
+            if legacy_vectors is not None:
+                # O memory.faiss antigo assumia que a posição i era a linha i + 1.
+                cursor.executemany(
+                    "UPDATE memories SET embedding = ? WHERE id = ? AND embedding IS NULL",
+                    [(self._vector_to_blob(vector), position + 1) for position, vector in enumerate(legacy_vectors)]
+                )
+                print(f"[Memory Service]: {len(legacy_vectors)} vetores do índice FAISS antigo associados às memórias.")
+            cursor.execute("PRAGMA user_version = 2")
+            conn.commit()
+        self.vector_index.legacy_vectors = None
+
+        if schema_version < 3:
+            # v3: índice lexical FTS5 sobre o resumo e as tags (rowid = memories.id).
+            try:
+                cursor.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
+                    USING fts5(summary, tags, tokenize = 'unicode61 remove_diacritics 2')
+                """)
+            except sqlite3.OperationalError as e:
+                print(f"[Memory Service]: FTS5 indisponível neste SQLite ({e}). A usar apenas a busca vetorial.")
+                conn.rollback()
+                return
+            cursor.execute("DELETE FROM memories_fts")
+            cursor.execute("SELECT id, summary, tags FROM memories")
+            for memory_id, summary, tags_json in cursor.fetchall():
+                try:
+                    tags = json.loads(tags_json) if tags_json else []
+                except json.JSONDecodeError:
+                    tags = []
+                self._index_memory_text(cursor, memory_id, summary, tags)
+            cursor.execute("PRAGMA user_version = 3")
+            conn.commit()
+
+    def _fts_enabled(self, cursor) -> bool:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'")
+        return cursor.fetchone() is not None
+
+    def _index_memory_text(self, cursor, memory_id: int, summary: str, tags: list):
+        cursor.execute(
+            "INSERT INTO memories_fts (rowid, summary, tags) VALUES (?, ?, ?)",
+            (memory_id, summary, " ".join(self._normalize_tags(tags)))
+        )
+
+    def _unindex_memory_text(self, cursor, memory_id: int):
+        if self._has_fts:
+            cursor.execute("DELETE FROM memories_fts WHERE rowid = ?", (memory_id,))
+
+    @staticmethod
+    def _vector_to_blob(vector) -> bytes:
+        return np.asarray(vector, dtype=np.float32).reshape(-1).tobytes()
+
+    @staticmethod
+    def _blob_to_vector(blob: bytes):
+        return np.frombuffer(blob, dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def reconcile_vector_index(self) -> dict:
+        """
+        Verifica se o memory.faiss e o memory.db contêm as mesmas memórias e repara
+        a diferença: vetores órfãos são removidos e linhas sem vetor são indexadas
+        a partir do embedding guardado (ou recalculado, se não existir).
+        """
+        with self._memory_write_lock:
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id FROM memories")
+                db_ids = {row[0] for row in cursor.fetchall()}
+
+            index_ids = self.vector_index.ids()
+            orphan_ids = sorted(index_ids - db_ids)
+            missing_ids = sorted(db_ids - index_ids)
+
+            if orphan_ids:
+                self.vector_index.remove(orphan_ids)
+            if missing_ids:
+                self._index_memories_from_db(missing_ids)
+            if orphan_ids or missing_ids:
+                print(f"[Memory Service]: Índice FAISS reparado ({len(orphan_ids)} vetores órfãos removidos, {len(missing_ids)} memórias reindexadas).")
+
+        return {"orphans_removed": len(orphan_ids), "missing_indexed": len(missing_ids)}
+
+    def _schedule_vector_index_rebuild(self):
+        """
+        Inicia em background a passagem do índice para IVF (ou o retreino), ou um
+        novo checkpoint do memory.faiss quando o registo incremental cresceu.
+        """
+        # Chamado em simultâneo pelas threads de arquivamento e pelas edições de memórias.
+        with self._index_rebuild_lock:
+            if self._index_rebuild_thread and self._index_rebuild_thread.is_alive():
+                return
+            if self.vector_index.needs_retrain():
+                target = self._rebuild_vector_index
+            elif self.vector_index.needs_checkpoint():
+                target = self._checkpoint_vector_index
+            else:
+                return
+            self._index_rebuild_thread = threading.Thread(target=target, daemon=True)
+            self._index_rebuild_thread.start()
+
+    def _checkpoint_vector_index(self):
+        snapshot = self.vector_index.begin_rebuild()
+        if snapshot is None:
+            return
+        try:
+            tombstones, delta_ids, delta_vectors = snapshot
+            new_index = self.vector_index.build_checkpoint(tombstones, delta_ids, delta_vectors)
+            self.vector_index.finish_rebuild(new_index)
+            print(f"[Memory Service]: Checkpoint do índice FAISS gravado. Total: {self.vector_index.ntotal}")
+        except Exception as e:
+            self.vector_index.abort_rebuild()
+            print(f"[Memory Service]: Erro ao gravar o checkpoint do índice FAISS: {e}")
+
+    def _rebuild_vector_index(self):
+        try:
+            with self._memory_write_lock:
+                if self.vector_index.begin_rebuild() is None:
+                    return
+                with self.db.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT id, embedding FROM memories WHERE embedding IS NOT NULL")
+                    rows = cursor.fetchall()
+
+            print(f"[Memory Service]: A reconstruir o índice FAISS com {len(rows)} memórias em background...")
+            ids = [memory_id for memory_id, _ in rows]
+            vectors = np.vstack([self._blob_to_vector(blob) for _, blob in rows])
+            new_index = self.vector_index.build_from(ids, vectors)
+
+            self.vector_index.finish_rebuild(new_index)
+            print(f"[Memory Service]: Índice FAISS reconstruído e substituído. Total: {self.vector_index.ntotal}")
+        except Exception as e:
+            self.vector_index.abort_rebuild()
+            print(f"[Memory Service]: Erro ao reconstruir o índice FAISS: {e}")
+
+    def _index_memories_from_db(self, memory_ids: list):
+        placeholders = ','.join('?' for _ in memory_ids)
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT id, summary, embedding FROM memories WHERE id IN ({placeholders})", memory_ids)
+            rows = cursor.fetchall()
+
+            to_encode = [(memory_id, summary) for memory_id, summary, blob in rows if blob is None]
+            if to_encode:
+                encoded = self.embedding_model.encode([summary for _, summary in to_encode])
+                cursor.executemany(
+                    "UPDATE memories SET embedding = ? WHERE id = ?",
+                    [(self._vector_to_blob(vector), memory_id) for (memory_id, _), vector in zip(to_encode, encoded)]
+                )
+                conn.commit()
+                encoded_by_id = {memory_id: vector for (memory_id, _), vector in zip(to_encode, encoded)}
+            else:
+                encoded_by_id = {}
+
+        ids = [row[0] for row in rows]
+        vectors = [self._blob_to_vector(blob) if blob is not None else encoded_by_id[memory_id] for memory_id, _, blob in rows]
+        if ids:
+            self.vector_index.add(ids, np.vstack(vectors))
+
+    @staticmethod
+    def _normalize_tags(tags) -> list:
+        if not isinstance(tags, list):
+            return []
+        return list(dict.fromkeys(tag.strip() for tag in tags if isinstance(tag, str) and tag.strip()))
+
+    def _link_memory_tags(self, cursor, memory_id: int, tags: list):
+        for tag in self._normalize_tags(tags):
+            cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+            cursor.execute(
+                "INSERT OR IGNORE INTO memory_tags (memory_id, tag_id) SELECT ?, id FROM tags WHERE name = ?",
+                (memory_id, tag)
+            )
+
+    def _load_master_tags(self):
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM tags")
+            self._master_tags = {row[0] for row in cursor.fetchall()}
+        self._master_tag_list = sorted(self._master_tags)
+
+    def get_master_tag_list(self) -> list:
+        with self._state_lock:
+            return list(self._master_tag_list)
+
+    def _register_master_tags(self, tags: list):
+        with self._state_lock:
+            new_tags = set(self._normalize_tags(tags)) - self._master_tags
+            if new_tags:
+                self._master_tags.update(new_tags)
+                self._master_tag_list = sorted(self._master_tags)
+
+    def get_memory_ids_by_tags(self, tags: list) -> list:
+        """IDs das memórias que partilham pelo menos uma das tags, das que partilham mais para as que partilham menos."""
+        tags = self._normalize_tags(tags)
+        if not tags:
+            return []
+        placeholders = ','.join('?' for _ in tags)
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT mt.memory_id FROM memory_tags mt
+                JOIN tags t ON t.id = mt.tag_id
+                WHERE t.name IN ({placeholders})
+                GROUP BY mt.memory_id
+                ORDER BY COUNT(*) DESC, mt.memory_id DESC
+                """,
+                tags
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def prefer_tagged_memories(self, memories: list, tags: list, n_results: int = 3) -> list:
+        """
+        Reordena memórias já recuperadas pelas tags do plano: primeiro as que partilham
+        mais tags, depois as restantes, mantendo a ordem de relevância dentro de cada grupo.
+        """
+        wanted = set(self._normalize_tags(tags))
+        if not wanted:
+            return memories[:n_results]
+        shared = [len(wanted.intersection(self._normalize_tags(memory.tags))) for memory in memories]
+        order = sorted(range(len(memories)), key=lambda i: -shared[i])
+        return [memories[i] for i in order[:n_results]]
+
+    def add_block_to_workbench(self, block_data: dict):
+        print(f"[Memory Service]: Bloco de tópico '{block_data.get('tags', [])}' adicionado à Bancada de Trabalho.")
+        self.workbench.append(block_data)
+
+    def process_conversation_block_for_archiving(self, block_data: dict):
+        with ARCHIVE_SECONDS.time():
+            self._archive_conversation_block(block_data)
+
+    def _archive_conversation_block(self, block_data: dict):
+        try:
+            print(f"[Memory Service]: Recebido bloco para arquivamento em background.")
+            conversation_chunk = block_data.get("block", [])
+            
+            if not conversation_chunk or len(conversation_chunk) < 2:
+                print("[Memory Service]: Bloco recebido é muito curto para ser processado. Ignorando.")
+                return
+
+            segmented_topics = self.segmenter.segment_conversation_by_topic(conversation_chunk)
+
+            for topic_name, topic_chunk in segmented_topics.items():
+                print(f"[Memory Service]: A processar o tópico '{topic_name}' do bloco...")
+                if not topic_chunk or len(topic_chunk) < 2:
+                    continue
+                summary = self.summarizer.summarize_conversation_chunk(topic_chunk)
+                if summary:
+                    master_tags = self.get_master_tag_list()
+                    final_tags = self.tagger.refine_and_consolidate_tags(
+                        summary=summary, 
+                        candidate_tags=self.predictive_tags_accumulator,
+                        session_tags=self.session_tags_cache,
+                        master_tag_list=master_tags
+                    )
+                    
+                    for tag in final_tags:
+                        if tag not in self.session_tags_cache:
+                            self.session_tags_cache.append(tag)
+                    
+                    self.add_to_long_term_memory(summary, final_tags, topic_chunk)
+                    ARCHIVED_MEMORIES_TOTAL.inc()
+            
+            self.predictive_tags_accumulator = []
+            print(f"[Memory Service]: Arquivamento do bloco concluído.")
+        
+        except Exception as e:
+            print(f"[Memory Service]: ERRO CRÍTICO DURANTE ARQUIVAMENTO EM BACKGROUND: {e}")
+
+    def add_to_long_term_memory(self, summary: str, tags: list, original_chunk: list):
+        with MEMORY_IO_SECONDS.time(operation="add_memory"):
+            self._add_to_long_term_memory(summary, tags, original_chunk)
+
+    def _add_to_long_term_memory(self, summary: str, tags: list, original_chunk: list):
+        try:
+            summary_embedding = np.asarray(self.embedding_model.encode([summary]), dtype=np.float32)[0]
+            
+            tags_json = json.dumps(tags)
+            chunk_json = json.dumps(original_chunk, ensure_ascii=False)
+            
+            with self._memory_write_lock:
+                with self.db.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "INSERT INTO memories (summary, tags, original_chunk, embedding) VALUES (?, ?, ?, ?)",
+                        (summary, tags_json, chunk_json, self._vector_to_blob(summary_embedding))
+                    )
+                    memory_id = cursor.lastrowid
+                    self._link_memory_tags(cursor, memory_id, tags)
+                    if self._has_fts:
+                        self._index_memory_text(cursor, memory_id, summary, tags)
+                    self.vector_index.add([memory_id], summary_embedding)
+                    try:
+                        conn.commit()
+                    except sqlite3.Error:
+                        self.vector_index.remove([memory_id])
+                        raise
+            self._register_master_tags(tags)
+            self._schedule_vector_index_rebuild()
+            
+            print(f"[Memory Service]: Nova memória arquivada no FAISS e DB. Total: {self.vector_index.ntotal}")
+        except Exception as e:
+            print(f"Erro ao salvar na memória de longo prazo: {e}")
+
+    def delete_memory(self, memory_id: int) -> bool:
+        """Remove uma memória do memory.db e o seu vetor do índice FAISS."""
+        try:
+            with self._memory_write_lock:
+                with self.db.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
+                    if cursor.rowcount == 0:
+                        return False
+                    self._unindex_memory_text(cursor, memory_id)
+                    conn.commit()
+                self.vector_index.remove([memory_id])
+            self._schedule_vector_index_rebuild()
+            print(f"[Memory Service]: Memória {memory_id} removida. Total: {self.vector_index.ntotal}")
+            return True
+        except Exception as e:
+            print(f"Erro ao remover a memória {memory_id}: {e}")
+            return False
+
+    def update_memory(self, memory_id: int, summary: str = None, tags: list = None) -> bool:
+        """Altera o resumo e/ou as tags de uma memória; um novo resumo é reindexado no FAISS."""
+        if summary is None and tags is None:
+            return False
+        try:
+            summary_embedding = None
+            if summary is not None:
+                summary_embedding = np.asarray(self.embedding_model.encode([summary]), dtype=np.float32)[0]
+
+            with self._memory_write_lock:
+                with self.db.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT 1 FROM memories WHERE id = ?", (memory_id,))
+                    if cursor.fetchone() is None:
+                        return False
+                    if summary is not None:
+                        cursor.execute(
+                            "UPDATE memories SET summary = ?, embedding = ? WHERE id = ?",
+                            (summary, self._vector_to_blob(summary_embedding), memory_id)
+                        )
+                    if tags is not None:
+                        cursor.execute("UPDATE memories SET tags = ? WHERE id = ?", (json.dumps(tags), memory_id))
+                        cursor.execute("DELETE FROM memory_tags WHERE memory_id = ?", (memory_id,))
+                        self._link_memory_tags(cursor, memory_id, tags)
+                    if self._has_fts:
+                        cursor.execute("SELECT summary, tags FROM memories WHERE id = ?", (memory_id,))
+                        current_summary, current_tags_json = cursor.fetchone()
+                        self._unindex_memory_text(cursor, memory_id)
+                        self._index_memory_text(cursor, memory_id, current_summary, json.loads(current_tags_json) if current_tags_json else [])
+                    conn.commit()
+                if summary_embedding is not None:
+                    self.vector_index.remove([memory_id])
+                    self.vector_index.add([memory_id], summary_embedding)
+            self._schedule_vector_index_rebuild()
+            if tags is not None:
+                self._register_master_tags(tags)
+            print(f"[Memory Service]: Memória {memory_id} atualizada.")
+            return True
+        except Exception as e:
+            print(f"Erro ao atualizar a memória {memory_id}: {e}")
+            return False
+            
+    @staticmethod
+    def _build_fts_query(text: str) -> str:
+        """Transforma o texto livre numa consulta FTS5 segura: termos entre aspas unidos por OR."""
+        terms = list(dict.fromkeys(term.lower() for term in re.findall(r"[^\W_]+", text) if len(term) > 1 or term.isdigit()))
+        return " OR ".join(f'"{term}"' for term in terms[:Config.HYBRID_MAX_QUERY_TERMS])
+
+    def _lexical_search(self, cursor, user_prompt: str, limit: int, allowed_ids: list = None) -> list:
+        """IDs das memórias ordenados por BM25 (nomes, identificadores e números exatos)."""
+        if not self._has_fts:
+            return []
+        fts_query = self._build_fts_query(user_prompt)
+        if not fts_query:
+            return []
+        if allowed_ids is None:
+            cursor.execute(
+                "SELECT rowid FROM memories_fts WHERE memories_fts MATCH ? ORDER BY bm25(memories_fts) LIMIT ?",
+                (fts_query, limit)
+            )
+        else:
+            # Os IDs vão como um array JSON para não esbarrar no limite de parâmetros do SQLite.
+            cursor.execute(
+                """
+                SELECT rowid FROM memories_fts
+                WHERE memories_fts MATCH ? AND rowid IN (SELECT value FROM json_each(?))
+                ORDER BY bm25(memories_fts) LIMIT ?
+                """,
+                (fts_query, json.dumps(allowed_ids), limit)
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _hybrid_search(self, cursor, prompt_embedding, user_prompt: str, candidate_count: int, allowed_ids: list = None) -> tuple:
+        with MEMORY_IO_SECONDS.time(operation="vector_search"):
+            dense_ids, _ = self.vector_index.search(prompt_embedding, candidate_count, allowed_ids=allowed_ids)
+        with MEMORY_IO_SECONDS.time(operation="lexical_search"):
+            lexical_ids = self._lexical_search(cursor, user_prompt, candidate_count, allowed_ids=allowed_ids)
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], k=Config.HYBRID_RRF_K)
+        return fused, len(dense_ids), lexical_ids
+
+    def embed_query(self, user_prompt: str):
+        with MEMORY_IO_SECONDS.time(operation="embed_query"):
+            return self.embedding_model.encode([user_prompt])
+
+    def search_memories(self, user_prompt: str, n_results: int = 3, tags: list = None, prompt_embedding=None) -> list:
+        """
+        Busca híbrida (FAISS + FTS5). Com `tags`, procura primeiro só entre as memórias
+        que partilham essas tags e recorre ao índice inteiro se houver poucos resultados.
+        As candidatas só vetoriais abaixo de RAG_MIN_SIMILARITY são descartadas (as
+        encontradas pelo FTS5 ficam, mesmo com cosseno baixo) e as restantes são
+        reordenadas por MMR. Devolve uma lista de RetrievedMemory, da mais relevante
+        para a menos relevante. `prompt_embedding` evita recalcular o embedding da pergunta.
+        """
+        if self.vector_index.ntotal == 0:
+            return []
+        candidate_count = n_results * Config.HYBRID_CANDIDATE_MULTIPLIER
+        if prompt_embedding is None:
+            prompt_embedding = self.embed_query(user_prompt)
+
+        tagged_ids = self.get_memory_ids_by_tags(tags) if tags else []
+        use_prefilter = n_results <= len(tagged_ids) <= Config.TAG_PREFILTER_MAX_CANDIDATES
+
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            fused = []
+            if use_prefilter:
+                fused, dense_count, lexical_ids = self._hybrid_search(
+                    cursor, prompt_embedding, user_prompt, candidate_count, allowed_ids=tagged_ids
+                )
+                scope = f"filtro por tags, {len(tagged_ids)} candidatas"
+            if len(fused) < n_results:
+                fused, dense_count, lexical_ids = self._hybrid_search(
+                    cursor, prompt_embedding, user_prompt, candidate_count
+                )
+                scope = "índice completo"
+            fused = fused[:candidate_count]
+            if not fused:
+                return []
+            db_ids = [memory_id for memory_id, _ in fused]
+            placeholders = ','.join('?' for _ in db_ids)
+            cursor.execute(f"SELECT id, summary, tags, embedding FROM memories WHERE id IN ({placeholders})", db_ids)
+            rows_by_id = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        candidates = [(memory_id, score) for memory_id, score in fused if memory_id in rows_by_id and rows_by_id[memory_id][2] is not None]
+        if not candidates:
+            return []
+        vectors = self._normalize(np.vstack([self._blob_to_vector(rows_by_id[memory_id][2]) for memory_id, _ in candidates]))
+        query = self._normalize(prompt_embedding)[0]
+        similarities = vectors @ query
+
+        # Correspondências exatas (identificadores, números) têm muitas vezes cosseno baixo.
+        lexical_hits = set(lexical_ids)
+        keep = [
+            i for i, similarity in enumerate(similarities)
+            if similarity >= Config.RAG_MIN_SIMILARITY or candidates[i][0] in lexical_hits
+        ]
+        if not keep:
+            print(f"[Memory Service]: Nenhuma memória acima da similaridade mínima ({Config.RAG_MIN_SIMILARITY}) nem encontrada pelo FTS5.")
+            return []
+        max_score = max(candidates[i][1] for i in keep)
+        order = maximal_marginal_relevance(
+            [candidates[i][1] / max_score for i in keep],
+            vectors[keep],
+            n_results,
+            lambda_mult=Config.RAG_MMR_LAMBDA,
+            duplicate_threshold=Config.RAG_DUPLICATE_SIMILARITY
+        )
+
+        results = []
+        for position in order:
+            i = keep[position]
+            memory_id, score = candidates[i]
+            summary, tags_json, _ = rows_by_id[memory_id]
+            results.append(RetrievedMemory(
+                memory_id=memory_id,
+                summary=summary,
+                tags=json.loads(tags_json) if tags_json else [],
+                similarity=float(similarities[i]),
+                score=score
+            ))
+        print(f"[Memory Service]: {len(results)} memórias relevantes recuperadas (FAISS + FTS5, {scope}, {dense_count} vetoriais, {len(lexical_ids)} lexicais, {len(keep)} mantidas).")
+        return results
+
+    @staticmethod
+    def format_recalled_memories(memories: list, token_budget: int = None) -> str:
+        """Formata as memórias por ordem de relevância até esgotar o orçamento de tokens."""
+        if token_budget is None:
+            token_budget = Config.RAG_TOKEN_BUDGET
+        lines = []
+        used_tokens = 0
+        for memory in memories:
+            line = f"- Lembrete de uma conversa anterior (Tópicos: {', '.join(memory.tags) if memory.tags else 'N/A'}): {memory.summary}"
+            line_tokens = estimate_tokens(line)
+            if used_tokens + line_tokens > token_budget:
+                break
+            lines.append(line)
+            used_tokens += line_tokens
+        return "\n".join(lines)
+
+    def retrieve_relevant_memories(self, user_prompt: str, n_results: int = 3, tags: list = None) -> str:
+        try:
+            return self.format_recalled_memories(self.search_memories(user_prompt, n_results, tags))
+        except Exception as e:
+            print(f"Erro ao recuperar memórias: {e}")
+            return "Ocorreu um erro enquanto eu tentava aceder à minha memória de longo prazo."
+
+    def _ensure_files_exist(self):
+        files_to_check = {
+            self.config_path: '{}'
+        }
+        for path, default_content in files_to_check.items():
+            if not os.path.exists(path):
+                print(f"[Memory Service]: Ficheiro '{os.path.basename(path)}' não encontrado. A criar um novo.")
+                with open(path, 'w', encoding='utf-8') as f:
+                     f.write(default_content)
+                     
+    def add_predictive_tags(self, tags: list):
+        self.predictive_tags_accumulator.extend(tags)
+        self.predictive_tags_accumulator = list(set(self.predictive_tags_accumulator))
+    
+    def _load_state_cache(self):
+        """Lê histórico e factos do disco uma única vez; daí em diante o disco só é escrito."""
+        cache_size = Config.HISTORY_CACHE_MAX_MESSAGES
+        self._history_cache = deque(self.history_store.get_last(cache_size), maxlen=cache_size)
+        self._history_total = self.history_store.count()
+        self._history_cache_complete = self._history_total <= cache_size
+        self._pending_history = []
+        self._history_summaries = self.history_store.get_summaries()
+        self._facts = self._read_facts_file()
+        self._facts_dirty = False
+
+    def add_to_history(self, message: dict):
+        with self._state_lock:
+            self._history_cache.append(message)
+            self._history_total += 1
+            if len(self._history_cache) == self._history_cache.maxlen:
+                self._history_cache_complete = False
+            self._pending_history.append(message)
+            should_flush = len(self._pending_history) >= Config.HISTORY_FLUSH_BATCH_SIZE
+        if should_flush:
+            self._flush_wakeup.set()
+        
+    def _read_facts_file(self):
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+                return json.loads(content) if content else {}
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Erro ao carregar o ficheiro de factos: {e}")
+            return {}
+
+    def load_facts(self):
+        with self._state_lock:
+            return dict(self._facts)
+            
+    def add_fact(self, new_facts: dict):
+        if not isinstance(new_facts, dict):
+            return
+        with self._state_lock:
+            self._facts.update(new_facts)
+            self._facts_dirty = True
+        self._flush_wakeup.set()
+        
+    def get_short_term_memory(self, limit: int = None):
+        with self._state_lock:
+            if limit is not None and limit <= 0:
+                return []
+            if self._history_cache_complete or (limit is not None and limit <= len(self._history_cache)):
+                cached = list(self._history_cache)
+                return cached if limit is None else cached[-limit:]
+        self.flush()
+        try:
+            return self.history_store.get_last(limit)
+        except sqlite3.Error as e:
+            print(f"Erro ao carregar o histórico: {e}")
+            return []
+
+    def get_history_tail(self) -> tuple:
+        """Devolve (posição da primeira mensagem, mensagens) do fim do histórico em cache."""
+        with self._state_lock:
+            return self._history_total - len(self._history_cache), list(self._history_cache)
+
+    def get_history_range(self, start_position: int, end_position: int) -> list:
+        with self._state_lock:
+            cache_start = self._history_total - len(self._history_cache)
+            if start_position >= cache_start:
+                cached = list(self._history_cache)
+                return cached[start_position - cache_start:end_position - cache_start]
+        self.flush()
+        try:
+            return self.history_store.get_range(start_position, end_position)
+        except sqlite3.Error as e:
+            print(f"Erro ao carregar o intervalo do histórico: {e}")
+            return []
+
+    def get_history_page(self, before_position: int = None, limit: int = None) -> tuple:
+        """
+        Devolve uma página do histórico terminando antes de `before_position`
+        (ou no fim do histórico) e o cursor da página anterior, ou None se não houver mais.
+        """
+        limit = limit or Config.HISTORY_PAGE_SIZE
+        with self._state_lock:
+            total = self._history_total
+        end_position = total if before_position is None else max(0, min(before_position, total))
+        start_position = max(0, end_position - limit)
+        messages = self.get_history_range(start_position, end_position)
+        return messages, (start_position if start_position > 0 else None)
+
+    def get_history_summaries(self) -> list:
+        with self._state_lock:
+            return list(self._history_summaries)
+
+    def add_history_summary(self, start_position: int, end_position: int, summary: str):
+        try:
+            self.history_store.add_summary(start_position, end_position, summary)
+        except sqlite3.Error as e:
+            print(f"Erro ao salvar resumo do histórico: {e}")
+            return
+        with self._state_lock:
+            self._history_summaries.append({"start": start_position, "end": end_position, "summary": summary})
+
+    def estimate_memory_bytes(self) -> int:
+        """Estimativa do estado residente deste usuário (vetores em RAM, histórico, bancada)."""
+        with self._state_lock:
+            history_bytes = sum(len(part) for message in self._history_cache for part in message.get("parts", []))
+            summary_bytes = sum(len(summary["summary"]) for summary in self._history_summaries)
+        workbench_bytes = sum(
+            len(part) for block in self.workbench for message in block.get("block", []) for part in message.get("parts", [])
+        )
+        return self.vector_index.resident_bytes() + history_bytes + summary_bytes + workbench_bytes
+
+    def flush(self):
+        """Grava no disco as mensagens pendentes e os factos alterados."""
+        with self._flush_lock:
+            with self._state_lock:
+                pending_history = self._pending_history
+                self._pending_history = []
+                facts_snapshot = dict(self._facts) if self._facts_dirty else None
+                self._facts_dirty = False
+
+            if pending_history:
+                try:
+                    with MEMORY_IO_SECONDS.time(operation="history_flush"):
+                        self.history_store.append_many(pending_history)
+                except sqlite3.Error as e:
+                    print(f"Erro ao salvar mensagens no histórico: {e}")
+                    with self._state_lock:
+                        self._pending_history = pending_history + self._pending_history
+
+            if facts_snapshot is not None:
+                with MEMORY_IO_SECONDS.time(operation="facts_flush"):
+                    saved = self._save_json(self.config_path, facts_snapshot)
+                if not saved:
+                    with self._state_lock:
+                        self._facts_dirty = True
+
+    def _background_flush_loop(self):
+        while not self._closed:
+            self._flush_wakeup.wait(Config.MEMORY_FLUSH_INTERVAL_SECONDS)
+            self._flush_wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Interrompe a escrita em background, grava o estado pendente e fecha as conexões. Chamado no logout."""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_wakeup.set()
+        self._flusher_thread.join(timeout=5)
+        self.flush()
+        if self._index_rebuild_thread and self._index_rebuild_thread.is_alive():
+            self._index_rebuild_thread.join(timeout=30)
+        self.db.close()
+        self.vector_index.close()
+            
+    def _save_json(self, file_path: str, data: list | dict) -> bool:
+        temp_path = file_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, file_path)
+            return True
+        except IOError as e:
+            print(f"Erro ao salvar o ficheiro {os.path.basename(file_path)}: {e}")
+            return False
@@ -0,0 +1,140 @@
+# Arquivo: services_backend/model_router.py
+
+import threading
+import time
+from config import Config
+
+
+class _ModelHealth:
+    def __init__(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.error_rate = 0.0
+        self.ttft_ewma = None
+        self.opened_at = 0.0
+        self.open_seconds = Config.MODEL_ROUTER_OPEN_SECONDS
+        self.probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+
+
+class ModelRouter:
+    """
+    Estado de saúde dos modelos de geração partilhado por todos os usuários.
+
+    Cada modelo tem um circuit breaker: após MODEL_ROUTER_FAILURE_THRESHOLD falhas
+    seguidas o circuito abre e o modelo deixa de ser tentado; passado o tempo de
+    espera, um único pedido de teste (half-open) decide se volta a fechar ou se
+    reabre com espera maior. Sucessos alimentam uma EWMA do tempo até ao primeiro
+    token, usada com a taxa de erro para ordenar a cascata junto com os rankings
+    estáticos de cada especialidade.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _health(self, model_name: str) -> _ModelHealth:
+        health = self._models.get(model_name)
+        if health is None:
+            health = self._models[model_name] = _ModelHealth()
+        return health
+
+    def allow(self, model_name: str) -> bool:
+        """Indica se o modelo pode ser tentado agora (no estado half-open, só um pedido de teste de cada vez)."""
+        with self._lock:
+            health = self._health(model_name)
+            if health.state == "closed":
+                return True
+            if health.state == "open":
+                if time.monotonic() - health.opened_at < health.open_seconds:
+                    return False
+                health.state = "half_open"
+                print(f"[Model Router]: Circuito de '{model_name}' em half-open; a enviar um pedido de teste.")
+            if health.probe_in_flight:
+                return False
+            health.probe_in_flight = True
+            return True
+
+    def record_success(self, model_name: str, ttft_seconds: float):
+        alpha = Config.MODEL_ROUTER_EWMA_ALPHA
+        with self._lock:
+            health = self._health(model_name)
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.error_rate = (1 - alpha) * health.error_rate
+            health.ttft_ewma = ttft_seconds if health.ttft_ewma is None else (1 - alpha) * health.ttft_ewma + alpha * ttft_seconds
+            if health.state != "closed":
+                print(f"[Model Router]: Modelo '{model_name}' recuperado; circuito fechado.")
+            health.state = "closed"
+            health.probe_in_flight = False
+            health.open_seconds = Config.MODEL_ROUTER_OPEN_SECONDS
+
+    def record_failure(self, model_name: str):
+        alpha = Config.MODEL_ROUTER_EWMA_ALPHA
+        with self._lock:
+            health = self._health(model_name)
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.error_rate = (1 - alpha) * health.error_rate + alpha
+            if health.state == "half_open":
+                # O pedido de teste falhou: reabre com um tempo de espera maior.
+                health.open_seconds = min(health.open_seconds * 2, Config.MODEL_ROUTER_MAX_OPEN_SECONDS)
+                self._open(model_name, health)
+            elif health.state == "closed" and health.consecutive_failures >= Config.MODEL_ROUTER_FAILURE_THRESHOLD:
+                self._open(model_name, health)
+
+    def record_slow(self, model_name: str, elapsed_seconds: float):
+        """Modelo ultrapassado por outro na corrida do primeiro token: conta o tempo decorrido como limite inferior da latência."""
+        alpha = Config.MODEL_ROUTER_EWMA_ALPHA
+        with self._lock:
+            health = self._health(model_name)
+            health.ttft_ewma = elapsed_seconds if health.ttft_ewma is None else (1 - alpha) * health.ttft_ewma + alpha * max(elapsed_seconds, health.ttft_ewma)
+            health.probe_in_flight = False
+
+    def release(self, model_name: str):
+        """Liberta o pedido de teste quando a chamada termina sem sucesso nem falha (ex.: cliente desligou)."""
+        with self._lock:
+            self._health(model_name).probe_in_flight = False
+
+    @staticmethod
+    def _open(model_name: str, health: _ModelHealth):
+        health.state = "open"
+        health.opened_at = time.monotonic()
+        health.probe_in_flight = False
+        print(f"[Model Router]: Circuito de '{model_name}' aberto por {health.open_seconds:.0f}s ({health.consecutive_failures} falhas seguidas).")
+
+    def rank(self, rankings: dict) -> list:
+        """
+        Ordena os modelos de uma especialidade pelo ranking estático descontado pela
+        latência (EWMA do primeiro token) e pela taxa de erro recentes. Modelos com o
+        circuito aberto vão para o fim.
+        """
+        with self._lock:
+            def score(model_name):
+                health = self._models.get(model_name)
+                static_rank = rankings[model_name]
+                if health is None:
+                    return (True, static_rank)
+                penalty = Config.MODEL_ROUTER_ERROR_WEIGHT * health.error_rate
+                if health.ttft_ewma is not None:
+                    penalty += Config.MODEL_ROUTER_LATENCY_WEIGHT * health.ttft_ewma
+                return (health.state != "open", static_rank - penalty)
+
+            return sorted(rankings, key=score, reverse=True)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model_name: {
+                    "state": health.state,
+                    "error_rate": round(health.error_rate, 3),
+                    "ttft_ewma_seconds": round(health.ttft_ewma, 3) if health.ttft_ewma is not None else None,
+                    "consecutive_failures": health.consecutive_failures,
+                    "successes": health.successes,
+                    "failures": health.failures,
+                    "retry_in_seconds": max(0.0, round(health.open_seconds - (now - health.opened_at), 1)) if health.state == "open" else 0.0,
+                }
+                for model_name, health in self._models.items()
+            }
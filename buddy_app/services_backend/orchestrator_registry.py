@@ -0,0 +1,295 @@
+# Arquivo: services_backend/orchestrator_registry.py
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from config import Config
+
+
+class OrchestratorRegistry:
+    """
+    Pool limitado das instâncias de OrchestratorService por usuário. As entradas
+    são removidas por LRU (limite de instâncias ou de memória estimada) ou por
+    inatividade; ao sair do pool o estado é gravado com `shutdown()` e a instância
+    é recriada a partir do disco no próximo acesso.
+    """
+
+    def __init__(self, factory, max_size: int = None, max_bytes: int = None, idle_ttl_seconds: float = None):
+        self._factory = factory
+        self.max_size = max_size or Config.ORCHESTRATOR_POOL_MAX_SIZE
+        self.max_bytes = max_bytes or Config.ORCHESTRATOR_POOL_MAX_BYTES
+        self.idle_ttl_seconds = idle_ttl_seconds or Config.ORCHESTRATOR_IDLE_TTL_SECONDS
+
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._last_used = {}
+        self._leases = {}
+        self._inflight = {}
+        self._closing = {}
+        self._shutdown_threads = []
+        # Instâncias removidas (logout) enquanto ainda estavam em uso; o último lease grava-as.
+        self._pending_removals = {}
+        # Criações em curso (pré-carregamento) de usuários que entretanto fizeram logout.
+        self._discarded_creations = set()
+
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "prefetches": 0}
+
+        self._closed = False
+        self._sweeper_wakeup = threading.Event()
+        self._sweeper_thread = threading.Thread(target=self._idle_sweep_loop, daemon=True)
+        self._sweeper_thread.start()
+
+    def get(self, user_id):
+        """Devolve a instância do usuário, criando-a (uma única vez, mesmo com acessos simultâneos) se necessário."""
+        with self._lock:
+            orchestrator = self._entries.get(user_id)
+            if orchestrator is not None:
+                self._entries.move_to_end(user_id)
+                self._last_used[user_id] = time.monotonic()
+                self._stats["hits"] += 1
+                return orchestrator
+
+            self._stats["misses"] += 1
+            future = self._inflight.get(user_id)
+            is_creator = future is None
+            if is_creator:
+                future = Future()
+                self._inflight[user_id] = future
+
+        if is_creator:
+            self._create(user_id, future)
+        return future.result()
+
+    def prefetch(self, user_id) -> Future:
+        """
+        Começa a criar a instância do usuário numa thread de fundo (login/conexão).
+        Um `get()` feito entretanto espera por esta criação em vez de a repetir.
+        """
+        with self._lock:
+            orchestrator = self._entries.get(user_id)
+            if orchestrator is not None:
+                self._last_used[user_id] = time.monotonic()
+                future = Future()
+                future.set_result(orchestrator)
+                return future
+            future = self._inflight.get(user_id)
+            if future is not None:
+                return future
+            future = Future()
+            self._inflight[user_id] = future
+            self._stats["prefetches"] += 1
+
+        def _hydrate():
+            try:
+                self._create(user_id, future)
+            except Exception as e:
+                print(f"[Orchestrator Registry]: Falha ao pré-carregar a instância do usuário {user_id}: {e}")
+
+        threading.Thread(target=_hydrate, daemon=True).start()
+        return future
+
+    def is_resident(self, user_id) -> bool:
+        with self._lock:
+            return user_id in self._entries
+
+    def _create(self, user_id, future: Future):
+        try:
+            # Se a instância anterior ainda está a gravar o estado, espera antes de reler o disco.
+            closing = self._closing.get(user_id)
+            if closing is not None:
+                closing.wait()
+            orchestrator = self._factory(user_id)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(user_id, None)
+                self._discarded_creations.discard(future)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop(user_id, None)
+            discarded = future in self._discarded_creations
+            self._discarded_creations.discard(future)
+            if discarded:
+                self._mark_closing(user_id)
+            else:
+                self._entries[user_id] = orchestrator
+                self._last_used[user_id] = time.monotonic()
+        future.set_result(orchestrator)
+        if discarded:
+            # Quem esperava por esta criação com lease() volta a pedir a instância e espera
+            # pela gravação antes de a recriar a partir do disco.
+            self._shutdown_entry(user_id, orchestrator)
+            print(f"[Orchestrator Registry]: Instância pré-carregada do usuário {user_id} descartada (logout).")
+            return
+        self._enforce_limits(protected_user_id=user_id)
+
+    @contextmanager
+    def lease(self, user_id):
+        """Usa a instância do usuário sem que ela possa ser removida do pool a meio do uso."""
+        while True:
+            orchestrator = self.get(user_id)
+            with self._lock:
+                # A instância pode ter sido removida entre o get() e o registo do uso.
+                if self._entries.get(user_id) is orchestrator:
+                    self._leases[user_id] = self._leases.get(user_id, 0) + 1
+                    break
+        try:
+            yield orchestrator
+        finally:
+            removed = None
+            with self._lock:
+                self._leases[user_id] -= 1
+                if self._leases[user_id] <= 0:
+                    del self._leases[user_id]
+                    removed = self._pending_removals.pop(user_id, None)
+                if removed is None:
+                    self._last_used[user_id] = time.monotonic()
+            if removed is not None:
+                self._shutdown_entry(user_id, removed)
+                print(f"[Orchestrator Registry]: Instância de serviços removida para o usuário {user_id}.")
+            self._enforce_limits()
+
+    def remove(self, user_id):
+        """
+        Remove e grava a instância do usuário (logout). Se outro separador ainda a estiver
+        a usar (lease), a gravação fica para quando o último lease terminar.
+        """
+        with self._lock:
+            orchestrator = self._entries.pop(user_id, None)
+            self._last_used.pop(user_id, None)
+            creation = self._inflight.get(user_id)
+            if creation is not None:
+                # A criação em curso termina, mas a instância não entra no pool.
+                self._discarded_creations.add(creation)
+            if orchestrator is not None:
+                self._mark_closing(user_id)
+                if user_id in self._leases:
+                    self._pending_removals[user_id] = orchestrator
+                    print(f"[Orchestrator Registry]: Instância do usuário {user_id} em uso; será gravada no fim do turno.")
+                    return
+        if orchestrator is not None:
+            self._shutdown_entry(user_id, orchestrator)
+            print(f"[Orchestrator Registry]: Instância de serviços removida para o usuário {user_id}.")
+
+    def _mark_closing(self, user_id):
+        self._closing[user_id] = threading.Event()
+
+    def _shutdown_in_background(self, user_id, orchestrator):
+        # A gravação do estado (joins de arquivamento, reconstrução do índice) pode demorar
+        # minutos; não deve bloquear o pedido de outro usuário que provocou a remoção.
+        # Uma recriação da mesma instância espera pelo evento de `_closing`.
+        thread = threading.Thread(target=self._shutdown_entry, args=(user_id, orchestrator), daemon=True)
+        with self._lock:
+            self._shutdown_threads = [t for t in self._shutdown_threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _shutdown_entry(self, user_id, orchestrator):
+        try:
+            orchestrator.shutdown()
+        except Exception as e:
+            print(f"[Orchestrator Registry]: Erro ao gravar o estado do usuário {user_id}: {e}")
+        finally:
+            with self._lock:
+                closing = self._closing.pop(user_id, None)
+            if closing is not None:
+                closing.set()
+
+    def _resident_sizes(self) -> list:
+        # A estimativa percorre o histórico e a bancada de cada usuário: é calculada fora
+        # do lock, sobre uma cópia das entradas (da menos para a mais recentemente usada).
+        with self._lock:
+            entries = list(self._entries.items())
+        return [(uid, orchestrator, orchestrator.estimate_memory_bytes()) for uid, orchestrator in entries]
+
+    def _enforce_limits(self, protected_user_id=None):
+        """Limite de instâncias, verificado a cada criação e fim de lease (o de memória fica no sweeper)."""
+        while True:
+            with self._lock:
+                if len(self._entries) <= self.max_size:
+                    return
+                victim = next(
+                    (uid for uid in self._entries if uid != protected_user_id and uid not in self._leases),
+                    None
+                )
+                if victim is None:
+                    return
+                orchestrator = self._entries.pop(victim)
+                self._last_used.pop(victim, None)
+                self._mark_closing(victim)
+                self._stats["evictions"] += 1
+            print(f"[Orchestrator Registry]: Instância do usuário {victim} removida por LRU (tamanho).")
+            self._shutdown_in_background(victim, orchestrator)
+
+    def enforce_memory_budget(self):
+        if not self.max_bytes:
+            return
+        sizes = self._resident_sizes()
+        resident_bytes = sum(size for _, _, size in sizes)
+        for uid, orchestrator, size in sizes:
+            if resident_bytes <= self.max_bytes:
+                return
+            with self._lock:
+                if self._entries.get(uid) is not orchestrator or uid in self._leases:
+                    continue
+                self._entries.pop(uid)
+                self._last_used.pop(uid, None)
+                self._mark_closing(uid)
+                self._stats["evictions"] += 1
+            resident_bytes -= size
+            print(f"[Orchestrator Registry]: Instância do usuário {uid} removida por LRU (memória).")
+            self._shutdown_in_background(uid, orchestrator)
+
+    def _idle_sweep_loop(self):
+        interval = max(1.0, min(self.idle_ttl_seconds / 4, 60.0, Config.ORCHESTRATOR_MEMORY_CHECK_SECONDS))
+        while not self._closed:
+            self._sweeper_wakeup.wait(interval)
+            if self._closed:
+                return
+            self.evict_idle()
+            self.enforce_memory_budget()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                uid for uid, last_used in self._last_used.items()
+                if now - last_used > self.idle_ttl_seconds and uid not in self._leases and uid in self._entries
+            ]
+            victims = [(uid, self._entries.pop(uid)) for uid in expired]
+            for uid in expired:
+                self._last_used.pop(uid, None)
+                self._mark_closing(uid)
+            self._stats["expirations"] += len(victims)
+        for uid, orchestrator in victims:
+            print(f"[Orchestrator Registry]: Instância do usuário {uid} removida por inatividade.")
+            self._shutdown_entry(uid, orchestrator)
+
+    def stats(self) -> dict:
+        resident_bytes = sum(size for _, _, size in self._resident_sizes())
+        with self._lock:
+            return {
+                **self._stats,
+                "resident": len(self._entries),
+                "resident_bytes": resident_bytes,
+                "leased": len(self._leases),
+                "max_size": self.max_size,
+                "max_bytes": self.max_bytes,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+            }
+
+    def shutdown_all(self):
+        self._closed = True
+        self._sweeper_wakeup.set()
+        with self._lock:
+            entries = list(self._entries.items()) + list(self._pending_removals.items())
+            self._entries.clear()
+            self._pending_removals.clear()
+            self._last_used.clear()
+            shutdown_threads = list(self._shutdown_threads)
+        for user_id, orchestrator in entries:
+            self._shutdown_entry(user_id, orchestrator)
+        for thread in shutdown_threads:
+            thread.join()
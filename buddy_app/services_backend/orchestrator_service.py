@@ -1,7 +1,12 @@
 # Arquivo: services_backend/orchestrator_service.py
 
+import asyncio
 import threading
 import os
+import queue
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 # --- CORREÇÕES DE IMPORTAÇÃO ---
 from models import ActionPlan
 from .memory_service import MemoryService
@@ -10,23 +15,39 @@ from .ai_adapter import AI_Adapter
 from .summarizer_service import SummarizerService
 from .tagger_service import TaggerService
 from .segmenter_service import SegmenterService
+from .model_router import ModelRouter
 from .utils.contextualizador import Contextualizador
 from .utils.similarity_util import calculate_jaccard_similarity
 from .utils.model_resolver import build_available_model_rankings
+from .utils.metrics import (
+    TURN_STAGE_SECONDS, CLASSIFIER_SECONDS, TIME_TO_FIRST_TOKEN_SECONDS,
+    STREAM_SECONDS, TURNS_TOTAL, MODEL_FAILURES_TOTAL
+)
 from config import Config
 # --- FIM DAS CORREÇÕES ---
 import json
 from dotenv import set_key, get_key
 
 
+# Threads partilhadas por todos os usuários para a recuperação especulativa (RAG)
+# feita em paralelo com o classificador.
+_speculative_retrieval_executor = ThreadPoolExecutor(
+    max_workers=Config.SPECULATIVE_RETRIEVAL_WORKERS,
+    thread_name_prefix="speculative-rag"
+)
+
+
 class OrchestratorService:
     WORKBENCH_SIMILARITY_THRESHOLD = 0.1
 
-    def __init__(self, memory_service: MemoryService, ai_adapter: AI_Adapter, embedding_model):
+    def __init__(self, memory_service: MemoryService, ai_adapter: AI_Adapter, embedding_model, intent_classifier=None, model_router: ModelRouter = None):
         print(f"[Orchestrator Service para Usuário {memory_service.user_data_path}]: A inicializar...")
         
         self.memory_service = memory_service
         self.ai_adapter = ai_adapter
+        self.intent_classifier = intent_classifier
+        # O estado de saúde dos modelos é partilhado entre usuários (ver app.py).
+        self.model_router = model_router or ModelRouter()
         
         self.prompt_builder = PromptBuilder(self.memory_service)
         self.contextualizador = Contextualizador(embedding_model)
@@ -34,8 +55,9 @@ class OrchestratorService:
         self.is_model_initialized = True
         
         self.MODEL_CASCADES = { "DEFAULT": ["gemini-1.5-flash-latest"] }
-        self.locked_models = set()
-        self.prompt_counter = 0
+        self._archive_threads = []
+        self._speculative_retrieval = None
+        self._shadow_threads = []
 
         print(f"[Orchestrator Service para Usuário {memory_service.user_data_path}]: Serviço inicializado.")
 
@@ -45,6 +67,28 @@ class OrchestratorService:
     def get_full_history(self) -> list:
         return self.memory_service.get_short_term_memory()
 
+    def get_history_page(self, cursor: int = None) -> tuple:
+        return self.memory_service.get_history_page(before_position=cursor)
+
+    def estimate_memory_bytes(self) -> int:
+        block_bytes = sum(
+            len(part) for message in self.contextualizador.current_conversation_block for part in message.get("parts", [])
+        )
+        return self.memory_service.estimate_memory_bytes() + block_bytes
+
+    def shutdown(self):
+        """Grava o estado pendente do usuário antes de a instância ser descartada."""
+        for background_thread in self._archive_threads + self._shadow_threads:
+            background_thread.join(timeout=60)
+        self._archive_threads = []
+        self._shadow_threads = []
+        if self._speculative_retrieval is not None and not self._speculative_retrieval.cancelled():
+            try:
+                self._speculative_retrieval.result(timeout=60)
+            except Exception:
+                pass
+        self.memory_service.close()
+
     def initialize_model(self):
         print("[Orchestrator Service]: A inicialização é tratada pelo AI_Adapter.")
         pass
@@ -78,29 +122,153 @@ class OrchestratorService:
             print(f"Erro ao guardar a chave e reconstruir modelos: {e}")
 
     def _get_action_plan(self, conversation_history: list) -> ActionPlan:
+        """
+        Tenta primeiro o classificador local (kNN sobre os planos anteriores); se a
+        confiança for baixa, usa o LLM e guarda o resultado como novo exemplo.
+        """
+        if not conversation_history:
+            return ActionPlan()
+        if self.intent_classifier is None:
+            with CLASSIFIER_SECONDS.time(source="llm"):
+                return self._classify_with_llm(conversation_history) or ActionPlan()
+
+        user_prompt = conversation_history[-1]['parts'][0]
         try:
-            if not conversation_history:
+            with CLASSIFIER_SECONDS.time(source="local"):
+                local_plan = self.intent_classifier.predict(user_prompt, self.memory_service.user_id)
+        except Exception as e:
+            print(f"[Orchestrator]: Erro no classificador local: {e}. A usar o LLM.")
+            local_plan = None
+
+        if local_plan is None:
+            with CLASSIFIER_SECONDS.time(source="llm"):
+                llm_plan = self._classify_with_llm(conversation_history)
+            if llm_plan is None:
                 return ActionPlan()
+            self._record_action_plan_in_background(user_prompt, llm_plan)
+            return llm_plan
 
-            recent_history = conversation_history[-4:]
-            context_prompt = "\n".join(
-                f"{msg['role']}: {msg['parts'][0]}" for msg in recent_history
-            )
+        if not self._start_shadow_classification(conversation_history, user_prompt, local_plan):
+            self._extract_facts_in_background(conversation_history)
+        return local_plan
+
+    async def _get_action_plan_async(self, conversation_history: list) -> ActionPlan:
+        """Versão asyncio de `_get_action_plan`: o kNN corre numa thread e o LLM usa o cliente assíncrono."""
+        if not conversation_history:
+            return ActionPlan()
+        if self.intent_classifier is None:
+            with CLASSIFIER_SECONDS.time(source="llm"):
+                return await self._classify_with_llm_async(conversation_history) or ActionPlan()
 
-            classifier_model = Config.MODEL_CONFIG['classifier']
-            available_specialties = list(Config.DYNAMIC_MODEL_RANKINGS.keys())
+        user_prompt = conversation_history[-1]['parts'][0]
+        try:
+            with CLASSIFIER_SECONDS.time(source="local"):
+                local_plan = await asyncio.to_thread(self.intent_classifier.predict, user_prompt, self.memory_service.user_id)
+        except Exception as e:
+            print(f"[Orchestrator]: Erro no classificador local: {e}. A usar o LLM.")
+            local_plan = None
 
-            classifier_system_prompt = (
-                "You are an expert task analyzer. Your goal is to analyze the user's request and respond with a single JSON object. "
-                "You must classify the request into one of the following specialties: "
-                f"{available_specialties}. Use 'conversation' for simple questions, greetings, or conversational chat. "
-                "The JSON object must have the following keys: 'specialty' (string), "
-                "'needs_search' (boolean), 'needs_long_term_memory' (boolean), "
-                "'tags' (a JSON array of 1-3 relevant keyword tags), and 'extracted_facts' (a JSON object or null)."
+        if local_plan is None:
+            with CLASSIFIER_SECONDS.time(source="llm"):
+                llm_plan = await self._classify_with_llm_async(conversation_history)
+            if llm_plan is None:
+                return ActionPlan()
+            self._record_action_plan_in_background(user_prompt, llm_plan)
+            return llm_plan
+
+        if not self._start_shadow_classification(conversation_history, user_prompt, local_plan):
+            self._extract_facts_in_background(conversation_history)
+        return local_plan
+
+    def _start_shadow_classification(self, conversation_history: list, user_prompt: str, local_plan: ActionPlan) -> bool:
+        if random.random() >= Config.INTENT_CLASSIFIER_SHADOW_RATE:
+            return False
+        shadow_thread = threading.Thread(
+            target=self._run_shadow_classification,
+            args=(list(conversation_history), user_prompt, local_plan),
+            daemon=True
+        )
+        shadow_thread.start()
+        self._shadow_threads = [t for t in self._shadow_threads if t.is_alive()] + [shadow_thread]
+        return True
+
+    def _extract_facts_in_background(self, conversation_history: list):
+        # Os planos locais não trazem factos; a extração corre fora do caminho da resposta.
+        facts_thread = threading.Thread(target=self._run_fact_extraction, args=(list(conversation_history),), daemon=True)
+        facts_thread.start()
+        self._shadow_threads = [t for t in self._shadow_threads if t.is_alive()] + [facts_thread]
+
+    def _run_fact_extraction(self, conversation_history: list):
+        try:
+            context_prompt = "\n".join(f"{msg['role']}: {msg['parts'][0]}" for msg in conversation_history[-4:])
+            response_json_str = self.ai_adapter.get_completion_sync(
+                model_name=Config.MODEL_CONFIG['classifier'],
+                prompt=context_prompt,
+                system_instruction=(
+                    "You extract durable facts the user states about themselves or their work (names, preferences, plans, decisions). "
+                    "Respond with a single JSON object with one key, 'extracted_facts' (a JSON object, or null if there are none)."
+                ),
+                json_mode=True
             )
+            extracted_facts = json.loads(response_json_str).get("extracted_facts")
+        except Exception as e:
+            print(f"[Orchestrator]: Erro ao extrair factos do turno: {e}")
+            return
+        if extracted_facts:
+            self.memory_service.add_fact(extracted_facts)
+            print(f"[Orchestrator]: Facto extraído (plano local) e salvo: {extracted_facts}")
 
+    def _record_action_plan_in_background(self, user_prompt: str, plan: ActionPlan):
+        # O embedding e o commit no SQLite não atrasam o início da geração.
+        record_thread = threading.Thread(target=self._record_action_plan, args=(user_prompt, plan), daemon=True)
+        record_thread.start()
+        self._shadow_threads = [t for t in self._shadow_threads if t.is_alive()] + [record_thread]
+
+    def _record_action_plan(self, user_prompt: str, plan: ActionPlan):
+        try:
+            self.intent_classifier.record(user_prompt, plan, self.memory_service.user_id)
+        except Exception as e:
+            print(f"[Orchestrator]: Não foi possível guardar o exemplo do classificador: {e}")
+
+    def _run_shadow_classification(self, conversation_history: list, user_prompt: str, local_plan: ActionPlan):
+        """
+        Executa o classificador LLM fora do caminho da resposta: mede a concordância com
+        o plano local, alimenta o classificador e guarda os factos extraídos.
+        """
+        with CLASSIFIER_SECONDS.time(source="llm_shadow"):
+            llm_plan = self._classify_with_llm(conversation_history)
+        if llm_plan is None:
+            return
+        self.intent_classifier.record_shadow_comparison(local_plan, llm_plan)
+        self._record_action_plan(user_prompt, llm_plan)
+        if llm_plan.extracted_facts:
+            self.memory_service.add_fact(llm_plan.extracted_facts)
+            print(f"[Orchestrator]: Facto extraído pelo classificador (sombra) e salvo: {llm_plan.extracted_facts}")
+
+    @staticmethod
+    def _build_classifier_request(conversation_history: list) -> tuple:
+        recent_history = conversation_history[-4:]
+        context_prompt = "\n".join(
+            f"{msg['role']}: {msg['parts'][0]}" for msg in recent_history
+        )
+
+        available_specialties = list(Config.DYNAMIC_MODEL_RANKINGS.keys())
+
+        classifier_system_prompt = (
+            "You are an expert task analyzer. Your goal is to analyze the user's request and respond with a single JSON object. "
+            "You must classify the request into one of the following specialties: "
+            f"{available_specialties}. Use 'conversation' for simple questions, greetings, or conversational chat. "
+            "The JSON object must have the following keys: 'specialty' (string), "
+            "'needs_search' (boolean), 'needs_long_term_memory' (boolean), "
+            "'tags' (a JSON array of 1-3 relevant keyword tags), and 'extracted_facts' (a JSON object or null)."
+        )
+        return context_prompt, classifier_system_prompt
+
+    def _classify_with_llm(self, conversation_history: list) -> ActionPlan | None:
+        try:
+            context_prompt, classifier_system_prompt = self._build_classifier_request(conversation_history)
             response_json_str = self.ai_adapter.get_completion_sync(
-                model_name=classifier_model,
+                model_name=Config.MODEL_CONFIG['classifier'],
                 prompt=context_prompt,
                 system_instruction=classifier_system_prompt,
                 json_mode=True
@@ -110,7 +278,56 @@ class OrchestratorService:
 
         except Exception as e:
             print(f"[Orchestrator]: Erro ao classificar plano de ação: {e}. Usando fallback.")
-            return ActionPlan()
+            return None
+
+    async def _classify_with_llm_async(self, conversation_history: list) -> ActionPlan | None:
+        try:
+            context_prompt, classifier_system_prompt = self._build_classifier_request(conversation_history)
+            response_json_str = await self.ai_adapter.get_completion_async(
+                model_name=Config.MODEL_CONFIG['classifier'],
+                prompt=context_prompt,
+                system_instruction=classifier_system_prompt,
+                json_mode=True
+            )
+            plan_data = json.loads(response_json_str)
+            return ActionPlan(**plan_data)
+
+        except Exception as e:
+            print(f"[Orchestrator]: Erro ao classificar plano de ação: {e}. Usando fallback.")
+            return None
+
+    def _start_speculative_retrieval(self, user_prompt: str):
+        """Agenda a busca especulativa; None se o usuário ainda não tem memórias de longo prazo."""
+        if self.memory_service.vector_index.ntotal == 0:
+            return None
+        speculative_retrieval = _speculative_retrieval_executor.submit(self._run_speculative_retrieval, user_prompt)
+        self._speculative_retrieval = speculative_retrieval
+        return speculative_retrieval
+
+    def _run_speculative_retrieval(self, user_prompt: str) -> tuple:
+        """
+        Embedding e busca global da última mensagem, feitos enquanto o classificador responde.
+        Devolve mais candidatas do que as usadas, para as tags do plano as reordenarem.
+        """
+        prompt_embedding = self.memory_service.embed_query(user_prompt)
+        return prompt_embedding, self.memory_service.search_memories(
+            user_prompt, n_results=Config.SPECULATIVE_RETRIEVAL_CANDIDATES, prompt_embedding=prompt_embedding
+        )
+
+    def _recall_memories(self, speculative_retrieval, user_prompt: str, tags: list) -> str:
+        try:
+            _, memories = speculative_retrieval.result()
+            # As tags do plano reordenam as candidatas já recuperadas, sem uma segunda busca.
+            memories = self.memory_service.prefer_tagged_memories(memories, tags)
+            return self.memory_service.format_recalled_memories(memories)
+        except Exception as e:
+            print(f"Erro ao recuperar memórias: {e}")
+            return "Ocorreu um erro enquanto eu tentava aceder à minha memória de longo prazo."
+
+    @staticmethod
+    def _specialty_label(specialty: str) -> str:
+        # A especialidade vem do LLM como texto livre: só as conhecidas viram etiqueta de métrica.
+        return specialty if specialty in Config.DYNAMIC_MODEL_RANKINGS else "other"
 
     def _resolve_model_cascade(self, action_plan: ActionPlan) -> list:
         specialty = action_plan.specialty
@@ -119,60 +336,146 @@ class OrchestratorService:
             return self.MODEL_CASCADES["DEFAULT"]
 
         rankings = Config.DYNAMIC_MODEL_RANKINGS[specialty]
-        sorted_models = sorted(rankings, key=rankings.get, reverse=True)
+        sorted_models = self.model_router.rank(rankings)
         
         print(f"[Orchestrator]: Cascata de modelos resolvida para especialidade '{specialty}': {sorted_models}")
         return sorted_models
 
     def generate_response_stream(self):
-        self.prompt_counter += 1
+        turn_started_at = time.perf_counter()
+        specialty = ""
         
         try:
-            system_instruction, conversation_history = self.prompt_builder.build_context()
+            with TURN_STAGE_SECONDS.time(stage="context", specialty=specialty):
+                system_instruction, conversation_history = self.prompt_builder.build_context()
             if not conversation_history:
                 yield "Histórico de conversa vazio. Por favor, envie uma mensagem."
                 yield "[STREAM_END]"
                 return
 
-            action_plan = self._get_action_plan(conversation_history)
+            retrieval_prompt = conversation_history[-1]['parts'][0]
+            speculative_retrieval = self._start_speculative_retrieval(retrieval_prompt)
+
+            with TURN_STAGE_SECONDS.time(stage="classifier") as stage_labels:
+                action_plan = self._get_action_plan(conversation_history)
+                specialty = self._specialty_label(action_plan.specialty)
+                stage_labels["specialty"] = specialty
             
             print(f"[Orchestrator]: Plano de Ação -> Especialidade: {action_plan.specialty}, Pesquisa Web: {action_plan.needs_search}, Memória Longo Prazo: {action_plan.needs_long_term_memory}, Tags: {action_plan.tags}")
             
-            if action_plan.extracted_facts:
-                self.memory_service.add_fact(action_plan.extracted_facts)
-                print(f"[Orchestrator]: Facto extraído pelo classificador e salvo: {action_plan.extracted_facts}")
+            self._apply_action_plan(action_plan, conversation_history)
+
+            if speculative_retrieval is not None and not action_plan.needs_long_term_memory:
+                # A busca já não é precisa: liberta a vaga nas threads partilhadas.
+                speculative_retrieval.cancel()
+
+            if action_plan.needs_long_term_memory and speculative_retrieval is not None:
+                print("[Orchestrator]: A aceder à memória de longo prazo (RAG)...")
+                with TURN_STAGE_SECONDS.time(stage="retrieval", specialty=specialty):
+                    retrieved_memories = self._recall_memories(speculative_retrieval, retrieval_prompt, action_plan.tags)
+                if retrieved_memories:
+                    conversation_history.append({"role": "user", "parts": [f"<RECALLED_MEMORIES>\n{retrieved_memories}\n</RECALLED_MEMORIES>"]})
+            
+            cascade = self._resolve_model_cascade(action_plan)
+            
+            full_response = ""
+            for chunk in self._execute_generation_cascade(cascade, system_instruction, conversation_history, specialty=specialty):
+                if chunk != "[STREAM_END]":
+                    full_response += chunk
+                yield chunk
+
+            if full_response:
+                model_response_message = {"role": "model", "parts": [full_response]}
+                self.contextualizador.add_model_response_to_block(model_response_message)
+            TURNS_TOTAL.inc(specialty=specialty, status="ok" if full_response else "empty")
 
-            last_user_message = conversation_history[-1]
+        except Exception as e:
+            TURNS_TOTAL.inc(specialty=specialty, status="error")
+            error_message = f"Ocorreu um erro fatal no Orquestrador: {e}"
+            print(error_message)
+            yield error_message
+            yield "[STREAM_END]"
+        finally:
+            TURN_STAGE_SECONDS.observe(time.perf_counter() - turn_started_at, stage="total", specialty=specialty)
+
+    def _apply_action_plan(self, action_plan: ActionPlan, conversation_history: list):
+        """Factos, deteção de fim de tópico (com arquivamento), tags preditivas e bancada de trabalho."""
+        specialty = self._specialty_label(action_plan.specialty)
+        if action_plan.extracted_facts:
+            self.memory_service.add_fact(action_plan.extracted_facts)
+            print(f"[Orchestrator]: Facto extraído pelo classificador e salvo: {action_plan.extracted_facts}")
+
+        last_user_message = conversation_history[-1]
+        with TURN_STAGE_SECONDS.time(stage="topic_detection", specialty=specialty):
             closed_block = self.contextualizador.add_message_and_check_topic(last_user_message, action_plan.tags)
+        
+        if closed_block:
+            print(f"[Orchestrator]: Contextualizador detectou fim de tópico.")
+            self.memory_service.add_block_to_workbench(closed_block)
             
-            if closed_block:
-                print(f"[Orchestrator]: Contextualizador detectou fim de tópico.")
-                self.memory_service.add_block_to_workbench(closed_block)
-                
-                print("[Orchestrator]: Agendando arquivamento em uma nova thread...")
-                archive_thread = threading.Thread(
-                    target=self.memory_service.process_conversation_block_for_archiving,
-                    args=(closed_block,)
-                )
-                archive_thread.start()
-
-            if action_plan.tags:
-                self.memory_service.add_predictive_tags(action_plan.tags)
+            print("[Orchestrator]: Agendando arquivamento em uma nova thread...")
+            archive_thread = threading.Thread(
+                target=self.memory_service.process_conversation_block_for_archiving,
+                args=(closed_block,)
+            )
+            archive_thread.start()
+            self._archive_threads = [t for t in self._archive_threads if t.is_alive()] + [archive_thread]
+
+        if action_plan.tags:
+            self.memory_service.add_predictive_tags(action_plan.tags)
 
+        with TURN_STAGE_SECONDS.time(stage="workbench", specialty=specialty):
             workbench_context = self._consult_workbench(action_plan.tags)
-            if workbench_context:
-                conversation_history.append({"role": "user", "parts": [workbench_context]})
+        if workbench_context:
+            conversation_history.append({"role": "user", "parts": [workbench_context]})
+
+    async def generate_response_stream_async(self):
+        """
+        Versão asyncio de `generate_response_stream`, para o AsyncRuntime: o classificador
+        LLM e o stream dos modelos usam os clientes assíncronos; o trabalho local e
+        bloqueante (SQLite, FAISS, embeddings) corre em `asyncio.to_thread`.
+        """
+        turn_started_at = time.perf_counter()
+        specialty = ""
+
+        try:
+            with TURN_STAGE_SECONDS.time(stage="context", specialty=specialty):
+                system_instruction, conversation_history = await asyncio.to_thread(self.prompt_builder.build_context)
+            if not conversation_history:
+                yield "Histórico de conversa vazio. Por favor, envie uma mensagem."
+                yield "[STREAM_END]"
+                return
+
+            retrieval_prompt = conversation_history[-1]['parts'][0]
+            speculative_retrieval = self._start_speculative_retrieval(retrieval_prompt)
 
-            if action_plan.needs_long_term_memory:
+            with TURN_STAGE_SECONDS.time(stage="classifier") as stage_labels:
+                action_plan = await self._get_action_plan_async(conversation_history)
+                specialty = self._specialty_label(action_plan.specialty)
+                stage_labels["specialty"] = specialty
+
+            print(f"[Orchestrator]: Plano de Ação -> Especialidade: {action_plan.specialty}, Pesquisa Web: {action_plan.needs_search}, Memória Longo Prazo: {action_plan.needs_long_term_memory}, Tags: {action_plan.tags}")
+
+            await asyncio.to_thread(self._apply_action_plan, action_plan, conversation_history)
+
+            if speculative_retrieval is not None and not action_plan.needs_long_term_memory:
+                # A busca já não é precisa: liberta a vaga nas threads partilhadas.
+                speculative_retrieval.cancel()
+
+            if action_plan.needs_long_term_memory and speculative_retrieval is not None:
                 print("[Orchestrator]: A aceder à memória de longo prazo (RAG)...")
-                retrieved_memories = self.memory_service.retrieve_relevant_memories(conversation_history[-1]['parts'][0])
+                with TURN_STAGE_SECONDS.time(stage="retrieval", specialty=specialty):
+                    # Espera pela busca especulativa sem ocupar uma thread.
+                    await asyncio.wait([asyncio.wrap_future(speculative_retrieval)])
+                    # A busca já terminou: só falta reordenar pelas tags e formatar, sem I/O.
+                    retrieved_memories = self._recall_memories(speculative_retrieval, retrieval_prompt, action_plan.tags)
                 if retrieved_memories:
                     conversation_history.append({"role": "user", "parts": [f"<RECALLED_MEMORIES>\n{retrieved_memories}\n</RECALLED_MEMORIES>"]})
-            
+
             cascade = self._resolve_model_cascade(action_plan)
-            
+
             full_response = ""
-            for chunk in self._execute_generation_cascade(cascade, system_instruction, conversation_history):
+            async for chunk in self._execute_generation_cascade_async(cascade, system_instruction, conversation_history, specialty=specialty):
                 if chunk != "[STREAM_END]":
                     full_response += chunk
                 yield chunk
@@ -180,12 +483,16 @@ class OrchestratorService:
             if full_response:
                 model_response_message = {"role": "model", "parts": [full_response]}
                 self.contextualizador.add_model_response_to_block(model_response_message)
+            TURNS_TOTAL.inc(specialty=specialty, status="ok" if full_response else "empty")
 
         except Exception as e:
+            TURNS_TOTAL.inc(specialty=specialty, status="error")
             error_message = f"Ocorreu um erro fatal no Orquestrador: {e}"
             print(error_message)
             yield error_message
             yield "[STREAM_END]"
+        finally:
+            TURN_STAGE_SECONDS.observe(time.perf_counter() - turn_started_at, stage="total", specialty=specialty)
 
     def _consult_workbench(self, current_prompt_tags: list) -> str:
         workbench = self.memory_service.workbench
@@ -220,35 +527,256 @@ class OrchestratorService:
         print("[Orchestrator]: Nenhum bloco relevante encontrado na Bancada.")
         return ""
 
-    def _execute_generation_cascade(self, cascade, system_instruction, conversation_history):
-        if self.prompt_counter > 1 and self.prompt_counter % 10 == 0 and self.locked_models:
-            print(f"[Orchestrator]: Resetando travas de fallback após {self.prompt_counter} prompts.")
-            self.locked_models.clear()
+    def _stream_attempt(self, model_name: str, system_instruction, conversation_history, events: queue.Queue, cancelled: threading.Event):
+        """Corre o stream de um modelo numa thread própria e envia os pedaços para `events`."""
+        stream = None
+        try:
+            stream = self.ai_adapter.get_completion_stream(
+                model_name=model_name,
+                conversation_history=conversation_history,
+                system_instruction=system_instruction
+            )
+            for chunk in stream:
+                if cancelled.is_set():
+                    return
+                if chunk == "[STREAM_END]":
+                    break
+                events.put((model_name, "chunk", chunk))
+            events.put((model_name, "end", None))
+        except Exception as e:
+            events.put((model_name, "error", e))
+        finally:
+            if stream is not None and cancelled.is_set():
+                stream.close()
+
+    def _execute_generation_cascade(self, cascade, system_instruction, conversation_history, specialty: str = ""):
+        """
+        Percorre a cascata de modelos (até 3 voltas). Se o modelo em curso não enviar o
+        primeiro pedaço dentro de GENERATION_FIRST_TOKEN_DEADLINE_SECONDS, o seguinte
+        arranca em paralelo; o primeiro a produzir texto ganha e os restantes são
+        cancelados. Uma falha depois de já ter havido texto termina a resposta com um
+        aviso, sem repetir a geração noutro modelo.
+        """
+        deadline = Config.GENERATION_FIRST_TOKEN_DEADLINE_SECONDS
+        pending_models = list(cascade) * 3
+        events = queue.Queue()
+        attempts = {}
+        winner = None
+        last_error = None
+        next_hedge_at = None
+
+        def start_next_attempt():
+            index = 0
+            while index < len(pending_models):
+                model_name = pending_models[index]
+                if model_name in attempts:
+                    # Ainda em curso: a entrada fica para uma nova tentativa caso este falhe.
+                    index += 1
+                    continue
+                pending_models.pop(index)
+                if not self.model_router.allow(model_name):
+                    print(f"[Orchestrator]: A saltar modelo com circuito aberto: {model_name}")
+                    continue
+                print(f"[Orchestrator]: A tentar com o modelo: {model_name}")
+                attempt = {"cancelled": threading.Event(), "started_at": time.perf_counter(), "outcome_recorded": False}
+                attempts[model_name] = attempt
+                threading.Thread(
+                    target=self._stream_attempt,
+                    args=(model_name, system_instruction, conversation_history, events, attempt["cancelled"]),
+                    daemon=True
+                ).start()
+                return True
+            return False
+
+        def cancel_attempt(model_name, lost_race=False):
+            attempt = attempts.pop(model_name)
+            attempt["cancelled"].set()
+            if attempt["outcome_recorded"]:
+                return
+            if lost_race:
+                self.model_router.record_slow(model_name, time.perf_counter() - attempt["started_at"])
+            else:
+                self.model_router.release(model_name)
+
+        try:
+            if start_next_attempt() and deadline:
+                next_hedge_at = time.perf_counter() + deadline
+
+            while attempts:
+                timeout = None
+                if winner is None and next_hedge_at is not None:
+                    timeout = max(0.0, next_hedge_at - time.perf_counter())
+                try:
+                    model_name, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # Prazo do primeiro pedaço esgotado: outro modelo, se houver, arranca em paralelo.
+                    print(f"[Orchestrator]: Sem resposta em {deadline}s; a procurar outro modelo para correr em paralelo.")
+                    next_hedge_at = time.perf_counter() + deadline if start_next_attempt() else None
+                    continue
+
+                attempt = attempts.get(model_name)
+                if attempt is None or (winner is not None and model_name != winner):
+                    continue
 
+                if kind == "error":
+                    MODEL_FAILURES_TOTAL.inc(model=model_name)
+                    self.model_router.record_failure(model_name)
+                    attempt["outcome_recorded"] = True
+                    attempts.pop(model_name)
+                    last_error = payload
+                    print(f"[Orchestrator]: Falha com o modelo {model_name}. Erro: {payload}")
+                    if winner == model_name:
+                        yield "\n\n[A resposta foi interrompida por uma falha do modelo. Por favor, tente novamente.]"
+                        yield "[STREAM_END]"
+                        return
+                    if not attempts and start_next_attempt() and deadline:
+                        next_hedge_at = time.perf_counter() + deadline
+                    continue
+
+                if winner is None:
+                    winner = model_name
+                    ttft = time.perf_counter() - attempt["started_at"]
+                    self.model_router.record_success(model_name, ttft)
+                    attempt["outcome_recorded"] = True
+                    if kind == "chunk":
+                        TIME_TO_FIRST_TOKEN_SECONDS.observe(ttft, model=model_name, specialty=specialty)
+                    for other_model in [m for m in attempts if m != model_name]:
+                        print(f"[Orchestrator]: Modelo {model_name} respondeu primeiro; a cancelar {other_model}.")
+                        cancel_attempt(other_model, lost_race=True)
+
+                if kind == "chunk":
+                    yield payload
+                else:
+                    STREAM_SECONDS.observe(time.perf_counter() - attempt["started_at"], model=model_name, specialty=specialty)
+                    attempts.pop(model_name)
+                    yield "[STREAM_END]"
+                    return
+        finally:
+            for model_name in list(attempts):
+                cancel_attempt(model_name)
+
+        yield f"Erro: Todos os modelos falharam após 3 tentativas. Último erro: {last_error}"
+        yield "[STREAM_END]"
+
+    async def _stream_attempt_async(self, model_name: str, system_instruction, conversation_history, events: asyncio.Queue):
+        """Corre o stream assíncrono de um modelo numa task e envia os pedaços para `events`."""
+        stream = self.ai_adapter.get_completion_stream_async(
+            model_name=model_name,
+            conversation_history=conversation_history,
+            system_instruction=system_instruction
+        )
+        try:
+            async for chunk in stream:
+                if chunk == "[STREAM_END]":
+                    break
+                events.put_nowait((model_name, "chunk", chunk))
+            events.put_nowait((model_name, "end", None))
+        except Exception as e:
+            events.put_nowait((model_name, "error", e))
+        finally:
+            await stream.aclose()
+
+    async def _execute_generation_cascade_async(self, cascade, system_instruction, conversation_history, specialty: str = ""):
+        """
+        Versão asyncio de `_execute_generation_cascade`, com as mesmas regras de corrida
+        pelo primeiro pedaço; cada tentativa é uma task e os perdedores são cancelados
+        de imediato (a ligação ao provedor é fechada).
+        """
+        deadline = Config.GENERATION_FIRST_TOKEN_DEADLINE_SECONDS
+        pending_models = list(cascade) * 3
+        events = asyncio.Queue()
+        attempts = {}
+        winner = None
         last_error = None
-        loop_count = 0
-        while loop_count < 3:
-            for model_name in cascade:
-                if model_name in self.locked_models:
-                    print(f"[Orchestrator]: A saltar modelo travado: {model_name}")
+        next_hedge_at = None
+
+        def start_next_attempt():
+            index = 0
+            while index < len(pending_models):
+                model_name = pending_models[index]
+                if model_name in attempts:
+                    # Ainda em curso: a entrada fica para uma nova tentativa caso este falhe.
+                    index += 1
+                    continue
+                pending_models.pop(index)
+                if not self.model_router.allow(model_name):
+                    print(f"[Orchestrator]: A saltar modelo com circuito aberto: {model_name}")
                     continue
+                print(f"[Orchestrator]: A tentar com o modelo: {model_name}")
+                attempts[model_name] = {
+                    "task": asyncio.create_task(self._stream_attempt_async(model_name, system_instruction, conversation_history, events)),
+                    "started_at": time.perf_counter(),
+                    "outcome_recorded": False,
+                }
+                return True
+            return False
+
+        def cancel_attempt(model_name, lost_race=False):
+            attempt = attempts.pop(model_name)
+            attempt["task"].cancel()
+            if attempt["outcome_recorded"]:
+                return
+            if lost_race:
+                self.model_router.record_slow(model_name, time.perf_counter() - attempt["started_at"])
+            else:
+                self.model_router.release(model_name)
+
+        try:
+            if start_next_attempt() and deadline:
+                next_hedge_at = time.perf_counter() + deadline
+
+            while attempts:
+                timeout = None
+                if winner is None and next_hedge_at is not None:
+                    timeout = max(0.0, next_hedge_at - time.perf_counter())
                 try:
-                    print(f"[Orchestrator]: A tentar com o modelo: {model_name}")
-                    yield from self.ai_adapter.get_completion_stream(
-                        model_name=model_name,
-                        conversation_history=conversation_history,
-                        system_instruction=system_instruction
-                    )
-                    return 
-                except Exception as e:
-                    last_error = e
-                    print(f"[Orchestrator]: Falha com o modelo {model_name}. A travar o modelo. Erro: {e}")
-                    self.locked_models.add(model_name)
-            
-            loop_count += 1
-            if loop_count < 3:
-                print(f"[Orchestrator]: Todos os modelos disponíveis falharam. A repetir loop ({loop_count}/3)...")
-        
+                    model_name, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"[Orchestrator]: Sem resposta em {deadline}s; a procurar outro modelo para correr em paralelo.")
+                    next_hedge_at = time.perf_counter() + deadline if start_next_attempt() else None
+                    continue
+
+                attempt = attempts.get(model_name)
+                if attempt is None or (winner is not None and model_name != winner):
+                    continue
+
+                if kind == "error":
+                    MODEL_FAILURES_TOTAL.inc(model=model_name)
+                    self.model_router.record_failure(model_name)
+                    attempt["outcome_recorded"] = True
+                    attempts.pop(model_name)
+                    last_error = payload
+                    print(f"[Orchestrator]: Falha com o modelo {model_name}. Erro: {payload}")
+                    if winner == model_name:
+                        yield "\n\n[A resposta foi interrompida por uma falha do modelo. Por favor, tente novamente.]"
+                        yield "[STREAM_END]"
+                        return
+                    if not attempts and start_next_attempt() and deadline:
+                        next_hedge_at = time.perf_counter() + deadline
+                    continue
+
+                if winner is None:
+                    winner = model_name
+                    ttft = time.perf_counter() - attempt["started_at"]
+                    self.model_router.record_success(model_name, ttft)
+                    attempt["outcome_recorded"] = True
+                    if kind == "chunk":
+                        TIME_TO_FIRST_TOKEN_SECONDS.observe(ttft, model=model_name, specialty=specialty)
+                    for other_model in [m for m in attempts if m != model_name]:
+                        print(f"[Orchestrator]: Modelo {model_name} respondeu primeiro; a cancelar {other_model}.")
+                        cancel_attempt(other_model, lost_race=True)
+
+                if kind == "chunk":
+                    yield payload
+                else:
+                    STREAM_SECONDS.observe(time.perf_counter() - attempt["started_at"], model=model_name, specialty=specialty)
+                    attempts.pop(model_name)
+                    yield "[STREAM_END]"
+                    return
+        finally:
+            for model_name in list(attempts):
+                cancel_attempt(model_name)
+
         yield f"Erro: Todos os modelos falharam após 3 tentativas. Último erro: {last_error}"
         yield "[STREAM_END]"
         
@@ -1,9 +1,11 @@
 import json
 from .memory_service import MemoryService
+from .context_assembler import ContextAssembler
 
 class PromptBuilder:
     def __init__(self, memory_service: MemoryService):
         self.memory_service = memory_service
+        self.context_assembler = ContextAssembler(memory_service, memory_service.summarizer)
         self.base_system_instruction = """You are Kiku, a desktop AI companion. Your personality is helpful and friendly. You need to respond the input in portuguese.
             Respond to the user concisely."""
 
@@ -21,6 +23,6 @@ class PromptBuilder:
             )
             system_instruction_final += facts_context
         
-        conversation_history = self.memory_service.get_short_term_memory()
+        conversation_history = self.context_assembler.assemble(system_instruction_final)
 
         return system_instruction_final, conversation_history
\ No newline at end of file
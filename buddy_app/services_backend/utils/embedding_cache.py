@@ -0,0 +1,196 @@
+# Arquivo: services_backend/utils/embedding_cache.py
+
+import os
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from .sqlite_manager import SQLiteConnectionManager
+
+
+class CachedEmbeddingModel:
+    """
+    Envolve o modelo de embeddings com uma cache LRU partilhada por todos os usuários.
+    A chave é o hash do nome do modelo com o texto normalizado; opcionalmente os vetores
+    também ficam num SQLite (limitado a EMBEDDING_CACHE_DISK_MAX_ENTRIES linhas, com
+    remoção das menos usadas), para sobreviverem a reinícios. Mantém a interface usada
+    pelo resto do código (`encode` e `get_sentence_embedding_dimension`).
+    """
+
+    def __init__(self, model, model_name: str, max_entries: int = None, disk_path: str = None, max_disk_entries: int = None):
+        self.model = model
+        self.model_name = model_name
+        self.max_entries = max_entries or Config.EMBEDDING_CACHE_MAX_ENTRIES
+        self.max_disk_entries = max_disk_entries or Config.EMBEDDING_CACHE_DISK_MAX_ENTRIES
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+        # O SQLite só é aberto (e criado) no primeiro uso, para que importar a aplicação
+        # (ex.: `flask init-db`) não crie ficheiros.
+        self.disk_path = disk_path
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._disk_entries = 0
+
+    def _get_db(self):
+        with self._db_lock:
+            if self._db is None:
+                os.makedirs(os.path.dirname(self.disk_path), exist_ok=True)
+                db = SQLiteConnectionManager(self.disk_path)
+                with db.connection() as conn:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS embedding_cache (
+                            key TEXT PRIMARY KEY,
+                            vector BLOB NOT NULL,
+                            last_used REAL NOT NULL DEFAULT 0
+                        )
+                    """)
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(embedding_cache)")}
+                    if "last_used" not in columns:
+                        # Linhas de versões anteriores ficam como as menos usadas.
+                        conn.execute("ALTER TABLE embedding_cache ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+                    conn.commit()
+                    self._disk_entries = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+                self._db = db
+            return self._db
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{self._normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, **kwargs):
+        """Como `model.encode`, mas só os textos ainda não vistos chegam ao modelo."""
+        if kwargs:
+            # Opções que alteram o resultado (tensores, normalização...) não passam pela cache.
+            return self.model.encode(texts, **kwargs)
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        keys = [self._key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[key] = vector
+            self._stats["hits"] += sum(1 for key in keys if key in vectors)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if missing and self.disk_path:
+            from_disk = self._read_disk(missing)
+            vectors.update(from_disk)
+            missing = [key for key in missing if key not in from_disk]
+            with self._lock:
+                self._stats["disk_hits"] += sum(1 for key in keys if key in from_disk)
+                for key, vector in from_disk.items():
+                    self._store(key, vector)
+
+        if missing:
+            text_by_key = dict(zip(keys, texts))
+            encoded = np.asarray(self.model.encode([text_by_key[key] for key in missing]), dtype=np.float32)
+            encoded_by_key = {}
+            for key, vector in zip(missing, encoded):
+                vector = vector.copy()
+                vector.setflags(write=False)
+                encoded_by_key[key] = vector
+            vectors.update(encoded_by_key)
+            with self._lock:
+                self._stats["misses"] += sum(1 for key in keys if key in encoded_by_key)
+                for key, vector in encoded_by_key.items():
+                    self._store(key, vector)
+            if self.disk_path:
+                self._write_disk(encoded_by_key)
+
+        result = np.vstack([vectors[key] for key in keys])
+        return result[0] if single else result
+
+    def _store(self, key: str, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, keys: list) -> dict:
+        found = {}
+        try:
+            with self._get_db().connection() as conn:
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ','.join('?' for _ in chunk)
+                    rows = conn.execute(f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", chunk)
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+                if found:
+                    # As linhas lidas voltam a contar como recentes para a remoção LRU.
+                    now = time.time()
+                    conn.executemany("UPDATE embedding_cache SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                    conn.commit()
+        except Exception as e:
+            print(f"[Embedding Cache]: Erro ao ler a cache em disco: {e}")
+        return found
+
+    def _write_disk(self, vectors_by_key: dict):
+        try:
+            db = self._get_db()
+            now = time.time()
+            with db.connection() as conn:
+                inserted = conn.executemany(
+                    "INSERT OR IGNORE INTO embedding_cache (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, vector.tobytes(), now) for key, vector in vectors_by_key.items()]
+                ).rowcount
+                conn.commit()
+            with self._db_lock:
+                self._disk_entries += max(inserted, 0)
+                overflow = self._disk_entries > self.max_disk_entries
+            if overflow:
+                self._evict_disk()
+        except Exception as e:
+            print(f"[Embedding Cache]: Erro ao gravar a cache em disco: {e}")
+
+    def _evict_disk(self):
+        # Desce até 90% do limite, para a limpeza não correr a cada nova linha.
+        target = int(self.max_disk_entries * 0.9)
+        with self._get_db().connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            if count > target:
+                conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN (SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?)",
+                    (count - target,)
+                )
+                conn.commit()
+                print(f"[Embedding Cache]: {count - target} embeddings menos usados removidos da cache em disco.")
+                count = target
+        with self._db_lock:
+            self._disk_entries = count
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "lookups": lookups,
+                "hit_rate": (self._stats["hits"] + self._stats["disk_hits"]) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_tier": bool(self.disk_path),
+                "disk_entries": self._disk_entries,
+                "max_disk_entries": self.max_disk_entries,
+            }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
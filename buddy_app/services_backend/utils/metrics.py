@@ -0,0 +1,171 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Métricas do processo (contadores e histogramas com etiquetas) exportadas no formato
+# de texto do Prometheus em /metrics. Cada métrica tem o seu próprio lock e as etiquetas
+# são guardadas como tuplos, para que registar uma observação custe poucos microssegundos.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco; as etiquetas podem ser completadas dentro do bloco."""
+        started_at = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+TURN_STAGE_SECONDS = REGISTRY.histogram(
+    "buddy_turn_stage_seconds",
+    "Duração de cada etapa de um turno de conversa.",
+    ("stage", "specialty")
+)
+CLASSIFIER_SECONDS = REGISTRY.histogram(
+    "buddy_classifier_seconds",
+    "Duração da classificação do plano de ação, por origem (local ou llm).",
+    ("source",)
+)
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "buddy_time_to_first_token_seconds",
+    "Tempo até ao primeiro pedaço de texto de cada modelo.",
+    ("model", "specialty")
+)
+STREAM_SECONDS = REGISTRY.histogram(
+    "buddy_stream_seconds",
+    "Duração total do stream de resposta de cada modelo.",
+    ("model", "specialty")
+)
+TURNS_TOTAL = REGISTRY.counter(
+    "buddy_turns_total",
+    "Turnos de conversa processados.",
+    ("specialty", "status")
+)
+MODEL_FAILURES_TOTAL = REGISTRY.counter(
+    "buddy_model_failures_total",
+    "Falhas de chamada a modelos de geração.",
+    ("model",)
+)
+MEMORY_IO_SECONDS = REGISTRY.histogram(
+    "buddy_memory_io_seconds",
+    "Duração das operações de I/O do MemoryService.",
+    ("operation",)
+)
+EMBEDDING_BATCH_SECONDS = REGISTRY.histogram(
+    "buddy_embedding_batch_seconds",
+    "Duração de cada lote de embeddings.",
+)
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram(
+    "buddy_embedding_batch_size",
+    "Número de textos por lote de embeddings.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+ARCHIVE_SECONDS = REGISTRY.histogram(
+    "buddy_archive_seconds",
+    "Duração do arquivamento de um bloco de conversa na memória de longo prazo.",
+)
+ARCHIVED_MEMORIES_TOTAL = REGISTRY.counter(
+    "buddy_archived_memories_total",
+    "Memórias de longo prazo criadas pelo arquivador.",
+)
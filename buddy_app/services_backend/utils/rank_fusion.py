@@ -0,0 +1,39 @@
+import numpy as np
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Combina várias listas de IDs ordenadas por relevância (Reciprocal Rank Fusion):
+    cada lista contribui 1 / (k + posição) para cada ID. Devolve [(id, score)] ordenado.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def maximal_marginal_relevance(relevance: list, vectors, k: int, lambda_mult: float = 0.7, duplicate_threshold: float = None) -> list:
+    """
+    Escolhe até k posições equilibrando relevância e diversidade (MMR). `vectors` deve
+    estar normalizado; candidatas com similaridade >= duplicate_threshold com uma já
+    escolhida são descartadas. Devolve as posições na ordem de escolha.
+    """
+    if not len(relevance):
+        return []
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    remaining = list(range(len(relevance)))
+    selected = []
+    while remaining and len(selected) < k:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+        mmr = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = int(np.argmax(mmr))
+        choice = remaining.pop(best)
+        if duplicate_threshold is not None and selected and redundancy[best] >= duplicate_threshold:
+            continue
+        selected.append(choice)
+    return selected
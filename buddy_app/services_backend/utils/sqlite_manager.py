@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import Config
+
+
+class SQLiteConnectionManager:
+    """
+    Pequeno pool de conexões persistentes para um único ficheiro SQLite.
+    Todas as conexões usam WAL, por isso leitores (thread do pedido) e o
+    escritor (threads de arquivamento) não se bloqueiam mutuamente.
+    """
+
+    def __init__(self, db_path: str, max_connections: int = None):
+        self.db_path = db_path
+        self._max_connections = max_connections or Config.SQLITE_MAX_CONNECTIONS
+        self._available = threading.BoundedSemaphore(self._max_connections)
+        self._lock = threading.Lock()
+        self._idle_connections = []
+        self._closed = False
+
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.SQLITE_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA cache_size=-{int(Config.SQLITE_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE_BYTES)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão do pool; transações não confirmadas são desfeitas na devolução."""
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"O gestor de conexões de '{self.db_path}' já foi fechado.")
+
+        self._available.acquire()
+        conn = None
+        try:
+            with self._lock:
+                conn = self._idle_connections.pop() if self._idle_connections else None
+            if conn is None:
+                conn = self._open_connection()
+            yield conn
+        finally:
+            if conn is not None:
+                self._release(conn)
+            self._available.release()
+
+    def _release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle_connections.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Fecha as conexões ociosas; as que estiverem emprestadas fecham ao ser devolvidas."""
+        with self._lock:
+            self._closed = True
+            idle_connections = self._idle_connections
+            self._idle_connections = []
+        for conn in idle_connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
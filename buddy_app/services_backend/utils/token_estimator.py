@@ -0,0 +1,14 @@
+import math
+
+# Estimativa local e barata: cerca de 4 caracteres por token para texto em
+# português/inglês, mais um custo fixo por mensagem (papel e separadores).
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def estimate_message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + sum(estimate_tokens(part) for part in message.get("parts", []))
@@ -0,0 +1,377 @@
+# Arquivo: services_backend/vector_index.py
+
+import os
+import math
+import struct
+import threading
+import numpy as np
+import faiss
+from config import Config
+
+
+class VectorIndex:
+    """
+    Índice FAISS das memórias de longo prazo cujos IDs são as chaves primárias
+    de `memories.id` (IndexIDMap2), e não a posição do vetor no índice.
+
+    Os vetores são normalizados e comparados por produto interno (similaridade
+    de cosseno). O índice começa plano e passa a IVF quando cresce; a
+    reconstrução corre fora do lock e é trocada atomicamente no fim.
+
+    Persistência incremental: o memory.faiss é um checkpoint só de leitura,
+    carregado com memory-mapping. Os vetores novos vão para um índice delta em
+    memória e as remoções de vetores do checkpoint viram "tombstones"; ambos são
+    registados no memory.faiss.log, que é reaplicado no arranque e esvaziado a
+    cada novo checkpoint.
+    """
+
+    _LOG_HEADER = struct.Struct("<cq")
+    _LOG_ADD = b"A"
+    _LOG_REMOVE = b"R"
+
+    def __init__(self, index_path: str, dimension: int):
+        self.index_path = index_path
+        self.log_path = index_path + '.log'
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        self.legacy_vectors = None
+        self._pending_ops = None
+        self._force_checkpoint = False
+
+        self.base_index = self._load_checkpoint()
+        self._base_ids = set(faiss.vector_to_array(self.base_index.id_map).tolist())
+        self._tombstones = set()
+        self.delta_index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+        self._delta_ids = set()
+
+        self._replay_log()
+        self._log_file = open(self.log_path, 'ab')
+
+    def _read_checkpoint(self):
+        """
+        Lê o memory.faiss com memory-mapping e indica se os vetores ficaram fora da RAM.
+        IO_FLAG_MMAP só mapeia as listas invertidas do IVF; os vetores do índice plano
+        precisam também de IO_FLAG_MMAP_IFC, que a leitura de um IVF recusa.
+        """
+        try:
+            return faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC), True
+        except RuntimeError:
+            loaded_index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+            return loaded_index, faiss.try_extract_index_ivf(loaded_index) is not None
+
+    def _load_checkpoint(self):
+        self._base_mmapped = False
+        try:
+            loaded_index, mmapped = self._read_checkpoint()
+        except RuntimeError:
+            loaded_index = None
+
+        if loaded_index is None:
+            self._base_from_file = False
+            return self._build_index(0)
+
+        if isinstance(loaded_index, faiss.IndexIDMap2):
+            if loaded_index.metric_type == faiss.METRIC_INNER_PRODUCT:
+                self._base_from_file = True
+                self._base_mmapped = mmapped
+                self._configure_search(loaded_index)
+                return loaded_index
+            # Índice L2 de uma versão anterior: fica vazio e o MemoryService
+            # reindexa as memórias a partir dos embeddings guardados no memory.db.
+            print("[Vector Index]: Índice FAISS com métrica L2 encontrado. A reindexar com produto interno.")
+        else:
+            # Ficheiro antigo sem mapa de IDs: guarda os vetores por posição para o
+            # MemoryService os associar às linhas do memory.db.
+            self.legacy_vectors = loaded_index.reconstruct_n(0, loaded_index.ntotal) if loaded_index.ntotal else np.empty((0, self.dimension), dtype=np.float32)
+
+        self._base_from_file = False
+        self._force_checkpoint = True
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        return self._build_index(0)
+
+    def _replay_log(self):
+        """Reaplica o registo de alterações feitas depois do último checkpoint."""
+        if not os.path.exists(self.log_path):
+            return
+        record_size = self._LOG_HEADER.size
+        vector_size = self.dimension * 4
+        replayed = 0
+        valid_length = 0
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + record_size <= len(data):
+            operation, memory_id = self._LOG_HEADER.unpack_from(data, offset)
+            end = offset + record_size + (vector_size if operation == self._LOG_ADD else 0)
+            if end > len(data) or operation not in (self._LOG_ADD, self._LOG_REMOVE):
+                break
+            if operation == self._LOG_ADD:
+                vector = np.frombuffer(data, dtype=np.float32, count=self.dimension, offset=offset + record_size)
+                self._apply_add(np.array([memory_id], dtype=np.int64), vector.reshape(1, -1).copy())
+            else:
+                self._apply_remove([memory_id])
+            offset = end
+            valid_length = end
+            replayed += 1
+
+        if valid_length < len(data):
+            # Registo incompleto no fim do ficheiro (queda a meio de uma escrita).
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(valid_length)
+        if replayed:
+            print(f"[Vector Index]: {replayed} alterações reaplicadas a partir do registo incremental.")
+
+    def _append_log(self, records: list):
+        for operation, memory_id, vector in records:
+            self._log_file.write(self._LOG_HEADER.pack(operation, int(memory_id)))
+            if vector is not None:
+                self._log_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+        self._log_file.flush()
+        os.fsync(self._log_file.fileno())
+
+    @staticmethod
+    def _ivf_list_count(ntotal: int) -> int:
+        """Número de listas IVF desejado para `ntotal` vetores (0 significa índice plano)."""
+        if ntotal < Config.VECTOR_INDEX_IVF_THRESHOLD:
+            return 0
+        # O FAISS precisa de cerca de 39 pontos de treino por lista.
+        return max(1, min(int(Config.VECTOR_INDEX_IVF_LISTS_PER_SQRT * math.sqrt(ntotal)), ntotal // 39))
+
+    def _build_index(self, ntotal: int, training_vectors=None):
+        nlist = self._ivf_list_count(ntotal)
+        if nlist == 0:
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        ivf_index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        ivf_index.train(training_vectors)
+        index = faiss.IndexIDMap2(ivf_index)
+        self._configure_search(index)
+        return index
+
+    @staticmethod
+    def _configure_search(index):
+        try:
+            faiss.extract_index_ivf(index).nprobe = Config.VECTOR_INDEX_IVF_NPROBE
+        except RuntimeError:
+            pass
+
+    def _current_list_count(self) -> int:
+        try:
+            return faiss.extract_index_ivf(self.base_index).nlist
+        except RuntimeError:
+            return 0
+
+    def _prepare(self, vectors):
+        vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def _apply_add(self, ids, vectors):
+        new_ids = [int(i) for i in ids]
+        present = [i for i in new_ids if i in self._delta_ids or (i in self._base_ids and i not in self._tombstones)]
+        if present:
+            # Reaplicar o registo depois de um checkpoint já incluído no ficheiro é idempotente.
+            keep = np.array([i not in present for i in new_ids])
+            ids, vectors = ids[keep], vectors[keep]
+            new_ids = [i for i in new_ids if i not in present]
+        if new_ids:
+            self.delta_index.add_with_ids(vectors, ids)
+            self._delta_ids.update(new_ids)
+
+    def _apply_remove(self, ids):
+        delta_ids = [int(i) for i in ids if int(i) in self._delta_ids]
+        if delta_ids:
+            self.delta_index.remove_ids(np.asarray(delta_ids, dtype=np.int64))
+            self._delta_ids.difference_update(delta_ids)
+        self._tombstones.update(int(i) for i in ids if int(i) in self._base_ids)
+
+    @property
+    def ntotal(self) -> int:
+        return self.base_index.ntotal - len(self._tombstones) + self.delta_index.ntotal
+
+    def resident_bytes(self) -> int:
+        """Bytes de vetores em RAM: o delta e, se os vetores não estão mapeados do disco, o checkpoint."""
+        vector_bytes = self.dimension * 4
+        base_bytes = 0 if self._base_mmapped else self.base_index.ntotal * vector_bytes
+        return base_bytes + self.delta_index.ntotal * vector_bytes
+
+    def ids(self) -> set:
+        with self._lock:
+            return (self._base_ids - self._tombstones) | self._delta_ids
+
+    def add(self, ids: list, vectors):
+        vectors = self._prepare(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            self._append_log([(self._LOG_ADD, memory_id, vector) for memory_id, vector in zip(ids, vectors)])
+            self._apply_add(ids, vectors)
+            if self._pending_ops is not None:
+                self._pending_ops.append(("add", ids, vectors))
+
+    def remove(self, ids: list) -> int:
+        if not ids:
+            return 0
+        with self._lock:
+            present = [int(i) for i in ids if int(i) in self._delta_ids or (int(i) in self._base_ids and int(i) not in self._tombstones)]
+            self._append_log([(self._LOG_REMOVE, memory_id, None) for memory_id in ids])
+            self._apply_remove(ids)
+            if self._pending_ops is not None:
+                self._pending_ops.append(("remove", np.asarray(ids, dtype=np.int64), None))
+            return len(present)
+
+    def _selector_params(self, index, allowed_ids: list):
+        selector = faiss.IDSelectorBatch(np.asarray(allowed_ids, dtype=np.int64))
+        try:
+            # Com o filtro, todas as listas IVF são visitadas, mas só os IDs permitidos são comparados.
+            nlist = faiss.extract_index_ivf(index).nlist
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nlist)
+        except RuntimeError:
+            return faiss.SearchParameters(sel=selector)
+
+    def _filtered_search(self, query, k: int, allowed_ids: list) -> dict:
+        candidates = {}
+        base_allowed = [i for i in allowed_ids if i in self._base_ids and i not in self._tombstones]
+        delta_allowed = [i for i in allowed_ids if i in self._delta_ids]
+        for index, index_allowed in ((self.base_index, base_allowed), (self.delta_index, delta_allowed)):
+            if not index_allowed:
+                continue
+            scores, ids = index.search(query, min(k, len(index_allowed)), params=self._selector_params(index, index_allowed))
+            for i, s in zip(ids[0], scores[0]):
+                if i != -1:
+                    candidates[int(i)] = float(s)
+        return candidates
+
+    def search(self, vector, k: int, allowed_ids: list = None) -> tuple:
+        """
+        Devolve (ids, similaridades de cosseno) dos k vizinhos mais próximos, sem as
+        posições vazias. Com `allowed_ids`, só esses IDs são considerados.
+        """
+        query = self._prepare(vector)[:1]
+        candidates = {}
+        with self._lock:
+            if self.ntotal == 0:
+                return [], []
+            if allowed_ids is not None:
+                candidates = self._filtered_search(query, k, [int(i) for i in allowed_ids])
+            elif self.base_index.ntotal:
+                base_k = min(k + len(self._tombstones), self.base_index.ntotal)
+                scores, ids = self.base_index.search(query, base_k)
+                for i, s in zip(ids[0], scores[0]):
+                    if i != -1 and int(i) not in self._tombstones:
+                        candidates[int(i)] = float(s)
+            if allowed_ids is None and self.delta_index.ntotal:
+                scores, ids = self.delta_index.search(query, min(k, self.delta_index.ntotal))
+                for i, s in zip(ids[0], scores[0]):
+                    if i != -1:
+                        candidates[int(i)] = float(s)
+        ranked = sorted(candidates.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [i for i, _ in ranked], [s for _, s in ranked]
+
+    def needs_retrain(self) -> bool:
+        """Verdadeiro quando o índice deve passar a IVF ou ser retreinado com mais listas."""
+        with self._lock:
+            if self._pending_ops is not None:
+                return False
+            desired_lists = self._ivf_list_count(self.ntotal)
+            current_lists = self._current_list_count()
+        if current_lists == 0:
+            return desired_lists > 0
+        return desired_lists >= current_lists * 2
+
+    def needs_checkpoint(self) -> bool:
+        with self._lock:
+            if self._pending_ops is not None:
+                return False
+            if self._force_checkpoint:
+                return True
+            return self.delta_index.ntotal + len(self._tombstones) >= Config.VECTOR_INDEX_CHECKPOINT_EVERY
+
+    def begin_rebuild(self):
+        """
+        A partir daqui as alterações são registadas para serem aplicadas ao novo índice.
+        Devolve None (e não faz nada) se já houver uma reconstrução em curso.
+        """
+        with self._lock:
+            if self._pending_ops is not None:
+                return None
+            self._pending_ops = []
+            tombstones = list(self._tombstones)
+            delta_ids = faiss.vector_to_array(self.delta_index.id_map).copy()
+            delta_vectors = self.delta_index.index.reconstruct_n(0, self.delta_index.ntotal) if self.delta_index.ntotal else None
+        return tombstones, delta_ids, delta_vectors
+
+    def build_from(self, ids: list, vectors):
+        """Treina e preenche um novo índice fora do lock (pode demorar em índices grandes)."""
+        vectors = self._prepare(vectors)
+        new_index = self._build_index(len(ids), training_vectors=vectors)
+        if len(ids):
+            new_index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+        return new_index
+
+    def build_checkpoint(self, tombstones: list, delta_ids, delta_vectors):
+        """Junta o checkpoint atual com o delta, sem retreinar (fora do lock)."""
+        if self._base_from_file:
+            new_index = faiss.read_index(self.index_path)
+        else:
+            new_index = faiss.clone_index(self.base_index)
+        if tombstones:
+            new_index.remove_ids(np.asarray(tombstones, dtype=np.int64))
+        if delta_vectors is not None and len(delta_ids):
+            new_index.add_with_ids(delta_vectors, delta_ids)
+        self._configure_search(new_index)
+        return new_index
+
+    def finish_rebuild(self, new_index):
+        """
+        Grava o novo checkpoint e troca-o atomicamente. O que mudou durante a
+        reconstrução passa a ser o novo delta e o novo conteúdo do registo.
+        """
+        temp_path = self.index_path + '.tmp'
+        faiss.write_index(new_index, temp_path)
+
+        with self._lock:
+            pending_ops = self._pending_ops or []
+            temp_log_path = self.log_path + '.tmp'
+            with open(temp_log_path, 'wb') as f:
+                for operation, ids, vectors in pending_ops:
+                    for position, memory_id in enumerate(ids):
+                        if operation == "add":
+                            f.write(self._LOG_HEADER.pack(self._LOG_ADD, int(memory_id)))
+                            f.write(vectors[position].tobytes())
+                        else:
+                            f.write(self._LOG_HEADER.pack(self._LOG_REMOVE, int(memory_id)))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Se o processo cair entre as duas trocas, o registo antigo é reaplicado
+            # sobre o checkpoint novo, o que é seguro porque a reaplicação é idempotente.
+            os.replace(temp_path, self.index_path)
+            self._log_file.close()
+            os.replace(temp_log_path, self.log_path)
+            self._log_file = open(self.log_path, 'ab')
+
+            self.base_index, self._base_mmapped = self._read_checkpoint()
+            self._configure_search(self.base_index)
+            self._base_from_file = True
+            self._base_ids = set(faiss.vector_to_array(self.base_index.id_map).tolist())
+            self._tombstones = set()
+            self.delta_index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+            self._delta_ids = set()
+            self._force_checkpoint = False
+            for operation, ids, vectors in pending_ops:
+                if operation == "add":
+                    self._apply_add(ids, vectors)
+                else:
+                    self._apply_remove(ids)
+            self._pending_ops = None
+
+    def abort_rebuild(self):
+        with self._lock:
+            self._pending_ops = None
+
+    def close(self):
+        with self._lock:
+            if not self._log_file.closed:
+                self._log_file.close()
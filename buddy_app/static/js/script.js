@@ -4,6 +4,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const chatForm = document.getElementById('chat-form');
     const userInput = document.getElementById('user-input');
     const chatContainer = document.querySelector('.chat-container');
+    let historyCursor = null;
+    let isLoadingHistory = false;
 
     socket.on('connect', () => {
         console.log('Conectado ao servidor! Aguardando histórico...');
@@ -19,9 +21,50 @@ document.addEventListener('DOMContentLoaded', function() {
                 addAIMessage(message.parts.join(' '), false); 
             }
         });
+        historyCursor = data.cursor;
+        isLoadingHistory = false;
         console.log('Histórico carregado.');
+        requestOlderHistoryIfNeeded();
     });
 
+    socket.on('history_page', (data) => {
+        const previousScrollHeight = chatContainer.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.history.forEach(message => {
+            if (message.role === 'user') {
+                fragment.appendChild(createUserMessage(message.parts.join(' ')));
+            } else if (message.role === 'model') {
+                fragment.appendChild(createAIMessage(message.parts.join(' '), false));
+            }
+        });
+        chatContainer.insertBefore(fragment, chatContainer.firstChild);
+        chatContainer.scrollTop += chatContainer.scrollHeight - previousScrollHeight;
+        historyCursor = data.cursor;
+        isLoadingHistory = false;
+        requestOlderHistoryIfNeeded();
+    });
+
+    chatContainer.addEventListener('scroll', () => {
+        if (chatContainer.scrollTop < 100) {
+            requestOlderHistory();
+        }
+    });
+
+    function requestOlderHistory() {
+        if (historyCursor === null || historyCursor === undefined || isLoadingHistory) {
+            return;
+        }
+        isLoadingHistory = true;
+        socket.emit('load_more_history', { 'cursor': historyCursor });
+    }
+
+    function requestOlderHistoryIfNeeded() {
+        // Sem barra de rolagem o evento 'scroll' nunca dispara; carrega mais até preencher o ecrã.
+        if (chatContainer.scrollHeight <= chatContainer.clientHeight) {
+            requestOlderHistory();
+        }
+    }
+
     let currentAiBubble;
     socket.on('stream_start', () => {
         currentAiBubble = addAIMessage("", true);
@@ -52,15 +95,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    function addUserMessage(text) {
+    function createUserMessage(text) {
         const messageDiv = document.createElement('div');
         messageDiv.className = 'user-message';
         messageDiv.innerHTML = `<div class="user-bubble"><p>${text}</p></div>`;
-        chatContainer.appendChild(messageDiv);
-        chatContainer.scrollTop = chatContainer.scrollHeight;
+        return messageDiv;
     }
 
-    function addAIMessage(text, isTyping) {
+    function createAIMessage(text, isTyping) {
         const messageDiv = document.createElement('div');
         messageDiv.className = 'ai-message';
         messageDiv.innerHTML = `
@@ -70,8 +112,18 @@ document.addEventListener('DOMContentLoaded', function() {
             <div class="typing-indicator">
                 <div class="dot"></div><div class="dot"></div><div class="dot"></div>
             </div>`;
-        chatContainer.appendChild(messageDiv);
         showTypingIndicator(messageDiv, isTyping);
+        return messageDiv;
+    }
+
+    function addUserMessage(text) {
+        chatContainer.appendChild(createUserMessage(text));
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    }
+
+    function addAIMessage(text, isTyping) {
+        const messageDiv = createAIMessage(text, isTyping);
+        chatContainer.appendChild(messageDiv);
         chatContainer.scrollTop = chatContainer.scrollHeight;
         return messageDiv;
     }
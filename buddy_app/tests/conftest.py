@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos da aplicação importam-se pela raiz de buddy_app (ex.: `from config import Config`).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from config import Config
+from services_backend.model_router import ModelRouter
+from services_backend.orchestrator_service import OrchestratorService
+
+
+class SlowThenFailingAdapter:
+    """A primeira chamada demora mais do que o prazo do primeiro pedaço e falha; as seguintes respondem."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    def get_completion_stream(self, model_name, conversation_history, system_instruction=None):
+        self.calls += 1
+        if self.calls == 1:
+            time.sleep(self.delay)
+            raise RuntimeError("falha do provedor")
+        yield "olá"
+        yield "[STREAM_END]"
+
+    async def get_completion_stream_async(self, model_name, conversation_history, system_instruction=None):
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.sleep(self.delay)
+            raise RuntimeError("falha do provedor")
+        yield "olá"
+        yield "[STREAM_END]"
+
+
+def _orchestrator(adapter):
+    orchestrator = OrchestratorService.__new__(OrchestratorService)
+    orchestrator.ai_adapter = adapter
+    orchestrator.model_router = ModelRouter()
+    return orchestrator
+
+
+def test_single_model_cascade_retries_after_slow_failure(monkeypatch):
+    monkeypatch.setattr(Config, "GENERATION_FIRST_TOKEN_DEADLINE_SECONDS", 0.05)
+    adapter = SlowThenFailingAdapter(delay=0.2)
+    orchestrator = _orchestrator(adapter)
+
+    chunks = list(orchestrator._execute_generation_cascade(["modelo-unico"], "", []))
+
+    assert chunks == ["olá", "[STREAM_END]"]
+    assert adapter.calls == 2
+
+
+def test_single_model_cascade_retries_after_slow_failure_async(monkeypatch):
+    monkeypatch.setattr(Config, "GENERATION_FIRST_TOKEN_DEADLINE_SECONDS", 0.05)
+    adapter = SlowThenFailingAdapter(delay=0.2)
+    orchestrator = _orchestrator(adapter)
+
+    async def collect():
+        return [chunk async for chunk in orchestrator._execute_generation_cascade_async(["modelo-unico"], "", [])]
+
+    assert asyncio.run(collect()) == ["olá", "[STREAM_END]"]
+    assert adapter.calls == 2